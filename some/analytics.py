@@ -0,0 +1,94 @@
+from collections import defaultdict
+
+from django.db import transaction, IntegrityError
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from some.models import Show, Order, SalesRollup, OutboxJob
+
+
+def bucket(show_time_start):
+    # day and hour of the show in the current timezone
+    start = timezone.localtime(show_time_start)
+    return start.date(), start.hour
+
+
+def record_sales(amounts):
+    # add tickets sold per show id to the rollup rows, one UPDATE per rollup row touched
+    totals = defaultdict(lambda: [0, 0])
+    for show_id, film_id, place_id, start, price in Show.objects.filter(id__in=amounts) \
+            .values_list('id', 'film_id', 'place_id', 'show_time_start', 'price'):
+        total = totals[bucket(start) + (film_id, place_id)]
+        total[0] += amounts[show_id]
+        total[1] += amounts[show_id] * price
+    for (date, hour, film_id, place_id), (tickets, revenue) in totals.items():
+        key = {'date': date, 'hour': hour, 'film_id': film_id, 'place_id': place_id}
+        changes = {'tickets': F('tickets') + tickets, 'revenue': F('revenue') + revenue}
+        if SalesRollup.objects.filter(**key).update(**changes):
+            continue
+        try:
+            with transaction.atomic():
+                SalesRollup.objects.create(tickets=tickets, revenue=revenue, **key)
+        except IntegrityError:
+            # created by a concurrent order
+            SalesRollup.objects.filter(**key).update(**changes)
+
+
+def rebuild_analytics(batch_size=1000):
+    # recount rollups from orders, returns the number of rollup rows; orders whose job is still waiting
+    # in the outbox are left to it, their jobs stay locked until the new rollups are committed
+    with transaction.atomic():
+        pending = [payload['order'] for payload in OutboxJob.objects.filter(kind='order', available_at__isnull=False)
+                   .select_for_update().values_list('payload', flat=True)]
+        return rollup_orders(Order.objects.exclude(id__in=pending), batch_size)
+
+
+def rollup_orders(orders, batch_size):
+    rows = orders.values_list('show__film_id', 'show__place_id', 'show__show_time_start', 'show__price') \
+        .annotate(tickets=Sum('amount')).order_by()
+    totals = defaultdict(lambda: [0, 0])
+    for film_id, place_id, start, price, tickets in rows.iterator():
+        total = totals[bucket(start) + (film_id, place_id)]
+        total[0] += tickets
+        total[1] += tickets * price
+    with transaction.atomic():
+        SalesRollup.objects.all().delete()
+        SalesRollup.objects.bulk_create((SalesRollup(date=date, hour=hour, film_id=film_id, place_id=place_id,
+                                                     tickets=tickets, revenue=revenue)
+                                         for (date, hour, film_id, place_id), (tickets, revenue) in totals.items()),
+                                        batch_size=batch_size)
+    return len(totals)
+
+
+def rollups(date_from=None, date_to=None):
+    queryset = SalesRollup.objects.all()
+    if date_from:
+        queryset = queryset.filter(date__gte=date_from)
+    if date_to:
+        queryset = queryset.filter(date__lte=date_to)
+    return queryset
+
+
+def sales_by(group, date_from=None, date_to=None):
+    # tickets and revenue summed by 'film', 'place', 'date' or 'hour'
+    fields = {'film': ('film_id', 'film__name'), 'place': ('place_id', 'place__name'),
+              'date': ('date', ), 'hour': ('hour', )}[group]
+    return rollups(date_from, date_to).values(*fields) \
+        .annotate(tickets=Sum('tickets'), revenue=Sum('revenue')).order_by(*fields)
+
+
+def occupancy_by_place(date_from=None, date_to=None):
+    # tickets sold against seats offered by the shows of each place
+    shows = Show.objects.all()
+    if date_from:
+        shows = shows.filter(show_time_start__date__gte=date_from)
+    if date_to:
+        shows = shows.filter(show_time_start__date__lte=date_to)
+    seats = dict(shows.values('place_id').annotate(seats=Sum('place__size')).values_list('place_id', 'seats'))
+    result = []
+    for row in sales_by('place', date_from, date_to):
+        offered = seats.get(row['place_id']) or 0
+        row['seats'] = offered
+        row['occupancy'] = round(100 * row['tickets'] / offered, 2) if offered else None
+        result.append(row)
+    return result
@@ -1,3 +1,7 @@
+import datetime
+
+from django.conf import settings
+from django.core.cache import caches
 from rest_framework.authentication import TokenAuthentication
 from django.utils import timezone
 from some.api.custom_token import TemporaryToken
@@ -6,16 +10,38 @@ from cinema.settings import TIME_TO_LOGOUT
 
 class TemporaryTokenAuthentication(TokenAuthentication):
     model = TemporaryToken
+    # last_action is only written once it is older than this, so the idle timeout may come that much earlier
+    activity_granularity = getattr(settings, 'TOKEN_ACTIVITY_GRANULARITY', datetime.timedelta(seconds=60))
+    cache = getattr(settings, 'TOKEN_CACHE', 'default')
+
+    def cache_key(self, key):
+        return f'token:{key}'
+
+    def get_token(self, key):
+        # token with its user from cache, the database is asked once per activity_granularity
+        cache = caches[self.cache] if self.cache else None
+        token = cache.get(self.cache_key(key)) if cache else None
+        if token is None:
+            user, token = super().authenticate_credentials(key)
+            if cache:
+                cache.set(self.cache_key(key), token, self.activity_granularity.total_seconds())
+        return token
 
     def authenticate_credentials(self, key):
         try:
-            user, token = super().authenticate_credentials(key)
+            token = self.get_token(key)
+            user = token.user
             if not user.is_superuser and not user.is_staff:
-                if timezone.now() - token.last_action >= TIME_TO_LOGOUT:
+                now = timezone.now()
+                if now - token.last_action >= TIME_TO_LOGOUT:
                     token.delete()
-                else:
-                    token.last_action = timezone.now()
-                    token.save()
+                    if self.cache:
+                        caches[self.cache].delete(self.cache_key(key))
+                elif now - token.last_action >= self.activity_granularity:
+                    self.model.objects.filter(pk=token.pk).update(last_action=now)
+                    token.last_action = now
+                    if self.cache:
+                        caches[self.cache].set(self.cache_key(key), token, self.activity_granularity.total_seconds())
             return user, token
         except:
             pass
@@ -0,0 +1,55 @@
+from collections import OrderedDict
+
+from django.conf import settings
+from rest_framework import serializers
+
+from some.api.serializers import DetailShowSerializer, SingleOrderSerializer
+from some.instrumentation import timed_serialization
+
+
+class FieldPlan:
+    # compiled once from a serializer class: the values() paths it needs and how to turn a row into
+    # the same representation, without creating field objects for every instance
+
+    def __init__(self, serializer_class, prefix=''):
+        self.steps = []
+        self.fields = []
+        for name, field in serializer_class().fields.items():
+            path = prefix + field.source
+            if isinstance(field, serializers.BaseSerializer):
+                plan = FieldPlan(type(field), prefix=path + '__')
+                self.fields += plan.fields
+                self.steps.append((name, None, plan))
+                continue
+            if isinstance(field, serializers.PrimaryKeyRelatedField):
+                # values() already gives the id
+                convert = None
+            else:
+                convert = field.to_representation
+            self.fields.append(path)
+            self.steps.append((name, path, convert))
+
+    def build(self, row):
+        data = OrderedDict()
+        for name, path, convert in self.steps:
+            if path is None:
+                data[name] = convert.build(row)
+            else:
+                value = row[path]
+                data[name] = value if value is None or convert is None else convert(value)
+        return data
+
+    def build_many(self, rows):
+        with timed_serialization():
+            return [self.build(row) for row in rows]
+
+
+show_plan = FieldPlan(DetailShowSerializer)
+order_plan = FieldPlan(SingleOrderSerializer)
+
+
+def use_fast_path(request):
+    value = request.query_params.get('fast')
+    if value is None:
+        return getattr(settings, 'FAST_SERIALIZERS', False)
+    return value not in ('0', 'false', '')
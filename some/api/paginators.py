@@ -1,6 +1,106 @@
-from rest_framework.pagination import PageNumberPagination
+import datetime
+import json
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination, CursorPagination
 
 class StandardResultsSetPagination(PageNumberPagination):
     page_size = 10
     page_size_query_param = 'page_size'
-    max_page_size = 10
\ No newline at end of file
+    max_page_size = 10
+
+
+class KeysetCursorPagination(CursorPagination):
+    # cursors hold the values of every ordering field, the last one unique, so a position is one row and
+    # rows sharing the first field never turn into an OFFSET; DRF's cursor only holds the first field
+
+    def _get_position_from_instance(self, instance, ordering):
+        values = [instance[field.lstrip('-')] if isinstance(instance, dict) else getattr(instance, field.lstrip('-'))
+                  for field in ordering]
+        return json.dumps([value.isoformat() if isinstance(value, datetime.datetime) else value
+                           for value in values])
+
+    def after(self, position, reverse):
+        # rows following position in the direction of the query: for (a, b) a >= x and (a > x or a = x and b > y),
+        # the first part lets the database range scan the index
+        try:
+            values = json.loads(position)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        condition = None
+        for field, value in reversed(list(zip(self.ordering, values))):
+            lookup = 'lt' if field.startswith('-') != reverse else 'gt'
+            following = Q(**{f'{field.lstrip("-")}__{lookup}': value})
+            if condition is not None:
+                following |= Q(**{field.lstrip('-'): value}) & condition
+            condition = following
+        lookup = 'lte' if self.ordering[0].startswith('-') != reverse else 'gte'
+        return Q(**{f'{self.ordering[0].lstrip("-")}__{lookup}': values[0]}) & condition
+
+    def paginate_queryset(self, queryset, request, view=None):
+        # CursorPagination.paginate_queryset with the whole position in the filter
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        offset, reverse, current_position = self.cursor or (0, False, None)
+
+        if reverse:
+            queryset = queryset.order_by(*(field[1:] if field.startswith('-') else f'-{field}'
+                                           for field in self.ordering))
+        else:
+            queryset = queryset.order_by(*self.ordering)
+        if current_position is not None:
+            queryset = queryset.filter(self.after(current_position, reverse))
+
+        # one row more tells whether there is a following page
+        results = list(queryset[offset:offset + self.page_size + 1])
+        self.page = results[:self.page_size]
+        has_following = len(results) > len(self.page)
+        following_position = self._get_position_from_instance(results[-1], self.ordering) if has_following else None
+
+        if reverse:
+            self.page.reverse()
+            self.has_next = current_position is not None or offset > 0
+            self.has_previous = has_following
+            self.next_position, self.previous_position = current_position, following_position
+        else:
+            self.has_next = has_following
+            self.has_previous = current_position is not None or offset > 0
+            self.next_position, self.previous_position = following_position, current_position
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+
+class ShowCursorPagination(KeysetCursorPagination):
+    # keyset pagination, no COUNT and no OFFSET however deep the page is
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    def get_ordering(self, request, queryset, view):
+        if request.query_params.get('sort') == 'price':
+            return ('price', 'id')
+        return ('show_time_start', 'id')
+
+
+class PlaceCursorPagination(CursorPagination):
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = 'id'
+
+
+class OrderCursorPagination(CursorPagination):
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = '-id'
@@ -1,23 +1,47 @@
+import csv
 import datetime
+from collections import OrderedDict
 from django.db.models.signals import post_save
+from django.http import StreamingHttpResponse, HttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 from django.dispatch import receiver
 from django.utils import timezone
+from django.utils.dateparse import parse_date
 from rest_framework import viewsets
 from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.decorators import action
-from rest_framework.permissions import IsAuthenticated, IsAdminUser
+from rest_framework.permissions import IsAuthenticated, IsAdminUser, IsAuthenticatedOrReadOnly, AllowAny
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
-from django.db.models import F, Q, Max, Sum
+from rest_framework.views import APIView
+from django.db.models import Q, Max
 from rest_framework import status
 from rest_framework import generics
 from some.api.custom_token import TemporaryToken
+from some.api.fast_serializers import show_plan, order_plan, use_fast_path
+from some.api.paginators import ShowCursorPagination, PlaceCursorPagination, OrderCursorPagination
 from some.api.permissions import IsAdminOrReadOnly
 from rest_framework.decorators import api_view
 from cinema.settings import AUTH_USER_MODEL
 from some.api.serializers import ShowSerializer, SingleOrderSerializer, FilmSerializer, \
     PlaceSerializer, OrderSerializer, DetailShowSerializer, RegSerializer, CreateOrderSerializer, \
-    LoginUserSerializer
-from some.models import Show, Place, Order
+    LoginUserSerializer, ClaimSeatsSerializer, SeatHoldSerializer, CartSerializer
+from some.analytics import sales_by, occupancy_by_place
+from some.exports import sales, FORMATS
+from some.holds import hold_seats, confirm_hold, release_hold
+from some.idempotency import idempotent
+from some.instrumentation import recorder, INSTRUMENTATION_PROMETHEUS
+from some.models import Show, Place, Order, SeatHold
+from some import schedule_cache
+from some.reservations import reserve_seats, reserve_cart, CartError
+from some.routers import ReplicaAPIMixin, pin_to_primary
+from some.spending import get_total
+from some.now_showing import calendar, upcoming, CALENDAR_DAYS, CALENDAR_MAX_DAYS
+from some.search import film_index, place_index
+from some.schedule_import import ScheduleImport, read_csv, read_json
+from some.seatmap import seat_map, claim_seats, SeatError, SeatTaken
 
 
 @receiver(post_save, sender=AUTH_USER_MODEL)
@@ -53,17 +77,61 @@ class CustomAuthToken(ObtainAuthToken):
         })
 
 
-class ShowViewSet(viewsets.ModelViewSet):
+def schedule_etag(request, *args, **kwargs):
+    return schedule_cache.version()
+
+
+def places_etag(request, *args, **kwargs):
+    # places don't show sold tickets
+    return schedule_cache.version(sales=False)
+
+
+class ShowViewSet(ReplicaAPIMixin, viewsets.ModelViewSet):
     permission_classes = (IsAdminOrReadOnly,)
     queryset = Show.objects.filter(show_time_start__gte=timezone.now())
     serializer_class = ShowSerializer
+    pagination_class = ShowCursorPagination
+    replica_actions = ('list', 'retrieve', 'seat_maps')
 
     def get_serializer_class(self):
         # DetailShowSerializer if get method - ShowSerializer if unsafe method
         if self.action == 'retrieve' or self.action == 'list':
             return DetailShowSerializer
         else:
-            return super().get_serializer()
+            return super().get_serializer_class()
+
+    def get_queryset(self):
+        return super().get_queryset().select_related('place', 'film')
+
+    @method_decorator(condition(etag_func=schedule_etag))
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+    @method_decorator(condition(etag_func=schedule_etag))
+    def list(self, request, *args, **kwargs):
+        # schedule pages are the same for everybody, serve them from cache; ?fast only changes how
+        # the page is built, so both paths share the key. next and previous are absolute links,
+        # so pages are kept per scheme and host
+        params = request.query_params
+        key = schedule_cache.make_key('api', request.scheme, request.get_host(),
+                                      *(params.get(name) for name in ('day', 'place', 'sort', 'start', 'cursor',
+                                                                       'page_size')))
+        data = schedule_cache.get(key)
+        if data is None:
+            if use_fast_path(request):
+                data = self.fast_list().data
+            else:
+                data = super().list(request, *args, **kwargs).data
+            schedule_cache.set(key, data)
+        return Response(data)
+
+    def fast_list(self):
+        # same response as list, built from values() rows
+        queryset = self.filter_queryset(self.get_queryset()).values(*show_plan.fields)
+        page = self.paginate_queryset(queryset)
+        if page is None:
+            return Response(show_plan.build_many(queryset))
+        return self.get_paginated_response(show_plan.build_many(page))
 
     def update(self, request, *args, **kwargs):
         # deny changes if at least one ticket has been sold
@@ -83,15 +151,11 @@ class ShowViewSet(viewsets.ModelViewSet):
             queryset = queryset.order_by('price')
         place_name = self.request.query_params.get('place')
 
-        if not self.request.query_params:
+        if not set(self.request.query_params) - {'cursor', 'page_size', 'fast'}:
             return queryset
 
         if place_name is not None:
-            try:
-                place = Place.objects.get(name=place_name)
-            except:
-                return queryset.none()
-            queryset = queryset.filter(place=place)
+            queryset = queryset.filter(place__name=place_name)
 
         day = self.request.query_params.get('day')
 
@@ -120,29 +184,137 @@ class ShowViewSet(viewsets.ModelViewSet):
         return queryset
 
     @action(detail=True, methods=['post'], permission_classes=(IsAuthenticated,))
+    @idempotent
     def create_order(self, request, pk):
         # action to buy tickets
         amount = request.data.get('amount')
         user = request.user.id
         serializer = CreateOrderSerializer(data={"amount": amount, "show": pk, "user": user})
         if serializer.is_valid():
-            show = Show.objects.get(id=pk)
+            show = serializer.validated_data['show']
             if show.show_time_end <= timezone.now():
                 return Response({'show error': 'trying to buy ticket for show in past'},
                                 status=status.HTTP_400_BAD_REQUEST)
-            show.busy += int(amount)
-            if show.busy > show.place.size:
+            if reserve_seats(show.id, user, serializer.validated_data['amount']) is None:
                 return Response({'amount error': 'not enough places in hall'}, status=status.HTTP_400_BAD_REQUEST)
-            serializer.save()
-            show.save()
+            pin_to_primary(user)
             return Response({'tickets': amount}, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    @action(detail=False, methods=['post'], permission_classes=(IsAuthenticated,))
+    @idempotent
+    def checkout(self, request):
+        # buy tickets for several shows at once, all of them or none
+        serializer = CartSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        items = [(item['show'], item['amount']) for item in serializer.validated_data['items']]
+        try:
+            orders = reserve_cart(request.user.id, items)
+        except CartError as e:
+            return Response({'cart error': str(e), 'show': e.show_id}, status=status.HTTP_400_BAD_REQUEST)
+        pin_to_primary(request.user.id)
+        return Response({'orders': [{'show': order.show_id, 'tickets': order.amount} for order in orders]},
+                        status=status.HTTP_201_CREATED)
+
+    @action(detail=True, methods=['post'], permission_classes=(IsAuthenticated,))
+    @idempotent
+    def hold(self, request, pk):
+        # keep tickets for the user while they pay, confirmed or released at api/holds/
+        amount = request.data.get('amount')
+        user = request.user.id
+        serializer = CreateOrderSerializer(data={"amount": amount, "show": pk, "user": user})
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        show = serializer.validated_data['show']
+        if show.show_time_end <= timezone.now():
+            return Response({'show error': 'trying to buy ticket for show in past'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        hold = hold_seats(show.id, user, serializer.validated_data['amount'])
+        if hold is None:
+            return Response({'amount error': 'not enough places in hall'}, status=status.HTTP_400_BAD_REQUEST)
+        pin_to_primary(user)
+        return Response(SeatHoldSerializer(hold).data, status=status.HTTP_201_CREATED)
+
+    @action(detail=True, methods=['get', 'post'], permission_classes=(IsAuthenticatedOrReadOnly,))
+    @idempotent
+    def seats(self, request, pk):
+        # get the seat map of the show or buy chosen seats
+        show = get_object_or_404(Show.objects.select_related('place'), id=pk)
+        if request.method == 'GET':
+            return Response(seat_map(show))
+        serializer = ClaimSeatsSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        if show.show_time_end <= timezone.now():
+            return Response({'show error': 'trying to buy ticket for show in past'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        try:
+            order = claim_seats(show, request.user.id, serializer.validated_data['seats'])
+        except SeatTaken as e:
+            return Response({'seats error': str(e)}, status=status.HTTP_409_CONFLICT)
+        except SeatError as e:
+            return Response({'seats error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if order is None:
+            return Response({'seats error': 'seats were taken meanwhile, try again'},
+                            status=status.HTTP_409_CONFLICT)
+        pin_to_primary(request.user.id)
+        return Response({'tickets': order.amount}, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['get'])
+    def seat_maps(self, request):
+        # seat maps of every show in the schedule in one query
+        shows = self.filter_queryset(self.get_queryset()).select_related('place')
+        return Response([dict(seat_map(show), show=show.id) for show in shows])
+
+    @action(detail=False, methods=['post'], permission_classes=(IsAdminUser,))
+    def import_schedule(self, request):
+        # create many shows at once from a CSV, JSON or NDJSON body
+        lines = (line.decode('utf-8') for line in request.stream or ())
+        if request.content_type.startswith('text/csv'):
+            rows = read_csv(lines)
+        else:
+            rows = read_json(lines)
+        try:
+            created, errors = ScheduleImport().run(rows, dry_run='dry_run' in request.query_params)
+        except (ValueError, csv.Error) as e:
+            return Response({'errors': f'cant read schedule: {e}'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'created': created, 'errors': errors},
+                        status=status.HTTP_201_CREATED if created else status.HTTP_400_BAD_REQUEST)
+
 
-class OrderListAPIView(generics.ListAPIView):
+class SeatHoldViewSet(viewsets.GenericViewSet):
+    # holds of the user: list them, confirm one into an order or release it
+    serializer_class = SeatHoldSerializer
+    permission_classes = (IsAuthenticated,)
+
+    def get_queryset(self):
+        return SeatHold.objects.filter(user=self.request.user, expires__gt=timezone.now()).order_by('expires')
+
+    def list(self, request):
+        return Response(self.get_serializer(self.get_queryset(), many=True).data)
+
+    def destroy(self, request, pk):
+        if not release_hold(pk, request.user.id):
+            return Response({'hold error': 'no such hold'}, status=status.HTTP_404_NOT_FOUND)
+        pin_to_primary(request.user.id)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @action(detail=True, methods=['post'])
+    @idempotent
+    def confirm(self, request, pk):
+        order = confirm_hold(pk, request.user.id)
+        if order is None:
+            return Response({'hold error': 'hold has expired or does not exist'}, status=status.HTTP_404_NOT_FOUND)
+        pin_to_primary(request.user.id)
+        return Response({'tickets': order.amount}, status=status.HTTP_201_CREATED)
+
+
+class OrderListAPIView(ReplicaAPIMixin, generics.ListAPIView):
     serializer_class = SingleOrderSerializer
     permission_classes = (IsAuthenticated,)
-    queryset = Order.objects.all()
+    queryset = Order.objects.select_related('show')
+    pagination_class = OrderCursorPagination
 
     def filter_queryset(self, queryset):
         # list only user's orders
@@ -153,24 +325,41 @@ class OrderListAPIView(generics.ListAPIView):
     def get_serializer_context(self):
         # get the sum of spent money on each page of orders
         context = super().get_serializer_context()
-        total = self.queryset.annotate(total=F('amount') * F('show__price')) \
-            .aggregate(Sum('total')).get('total__sum')
-        tmp = {'total': total}
+        tmp = {'total': get_total(self.request.user.id)}
         context.update(tmp)
         return context
 
+    def list(self, request, *args, **kwargs):
+        if not use_fast_path(request):
+            return super().list(request, *args, **kwargs)
+        # same response built from values() rows
+        queryset = self.filter_queryset(self.get_queryset()).values(*order_plan.fields)
+        page = self.paginate_queryset(queryset)
+        total = self.get_serializer_context().get('total') or 0
+        data = OrderedDict(total=total, orders=order_plan.build_many(queryset if page is None else page))
+        return Response(data) if page is None else self.get_paginated_response(data)
+
     def get_serializer(self, *args, **kwargs):
+        # wrap already fetched orders, validating them back as input would query every show again
         ser = super().get_serializer(*args, **kwargs)
         total = ser.context.get('total') or 0
-        serializer = OrderSerializer(data={'total': total, 'orders': ser.data})
-        serializer.is_valid()
-        return serializer
+        return OrderSerializer({'total': total, 'orders': ser.instance}, context=ser.context)
 
 
-class PlaceViewSet(viewsets.ModelViewSet):
+class PlaceViewSet(ReplicaAPIMixin, viewsets.ModelViewSet):
     permission_classes = (IsAdminOrReadOnly,)
     serializer_class = PlaceSerializer
     queryset = Place.objects.all()
+    pagination_class = PlaceCursorPagination
+    replica_actions = ('list', 'retrieve')
+
+    @method_decorator(condition(etag_func=places_etag))
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @method_decorator(condition(etag_func=places_etag))
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
 
     def update(self, request, *args, **kwargs):
         # unable to modify place if it has sold tickets
@@ -185,3 +374,116 @@ class PlaceViewSet(viewsets.ModelViewSet):
 class FilmCreateAPIView(generics.CreateAPIView):
     permission_classes = (IsAdminUser,)
     serializer_class = FilmSerializer
+
+
+class CalendarAPIView(APIView):
+    # films and their shows with free seats per day from the materialized calendar, ?from=YYYY-MM-DD&days=30
+    permission_classes = (AllowAny,)
+
+    def get(self, request):
+        first = request.query_params.get('from')
+        try:
+            first = parse_date(first) if first else timezone.localdate()
+            count = min(max(int(request.query_params.get('days', CALENDAR_DAYS)), 1), CALENDAR_MAX_DAYS)
+        except ValueError:
+            first = None
+        if first is None:
+            return Response({'errors': 'from must look like YYYY-MM-DD and days be a number'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        now = timezone.now()
+        return Response([{'date': date, 'films': upcoming(films, now)} for date, films in calendar(first, count)])
+
+
+class SearchAPIView(APIView):
+    # autocomplete of film and place names from the in-memory index, ?q=words&limit=10
+    permission_classes = (AllowAny,)
+
+    def get(self, request):
+        query = request.query_params.get('q', '')
+        try:
+            limit = min(max(int(request.query_params.get('limit', 10)), 1), 50)
+        except ValueError:
+            return Response({'errors': 'limit must be a number'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({
+            'films': [{'id': film_id, 'name': name} for film_id, name in film_index.search(query, limit)],
+            'places': [{'id': place_id, 'name': name} for place_id, name in place_index.search(query, limit)],
+        })
+
+
+class SalesExportAPIView(APIView):
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        # stream every order with its show, film and place, ?output=csv|ndjson&date=YYYY-MM-DD
+        output = request.query_params.get('output', 'csv')
+        if output not in FORMATS:
+            return Response({'errors': f"output must be one of {', '.join(FORMATS)}"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        date = request.query_params.get('date')
+        if date is not None:
+            try:
+                date = parse_date(date)
+            except ValueError:
+                date = None
+            if date is None:
+                return Response({'errors': 'date must look like YYYY-MM-DD'}, status=status.HTTP_400_BAD_REQUEST)
+        writer, content_type = FORMATS[output]
+        response = StreamingHttpResponse(writer(sales(date)), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="sales-{date or "all"}.{output}"'
+        return response
+
+
+class AnalyticsViewSet(viewsets.ViewSet):
+    # dashboards read from the sales rollups, ?from=YYYY-MM-DD&to=YYYY-MM-DD
+    permission_classes = (IsAdminUser,)
+
+    def get_period(self):
+        period = []
+        for name in ('from', 'to'):
+            value = self.request.query_params.get(name)
+            try:
+                date = parse_date(value) if value else None
+            except ValueError:
+                date = None
+            if value and date is None:
+                raise ValidationError({name: 'date must look like YYYY-MM-DD'})
+            period.append(date)
+        return period
+
+    @action(detail=False)
+    def films(self, request):
+        return Response(sales_by('film', *self.get_period()))
+
+    @action(detail=False)
+    def places(self, request):
+        return Response(occupancy_by_place(*self.get_period()))
+
+    @action(detail=False)
+    def days(self, request):
+        return Response(sales_by('date', *self.get_period()))
+
+    @action(detail=False)
+    def hours(self, request):
+        # busiest hours first
+        return Response(sales_by('hour', *self.get_period()).order_by('-tickets'))
+
+
+class InstrumentationViewSet(viewsets.ViewSet):
+    # what some.middleware.Instrumentation has measured in this process
+    permission_classes = (IsAdminUser,)
+
+    def list(self, request):
+        # histograms of the last requests per view
+        return Response(recorder.histograms())
+
+    @action(detail=False)
+    def profiles(self, request):
+        # cProfile stats of the slowest sampled requests, see INSTRUMENTATION_PROFILE_RATE
+        return Response(recorder.slowest())
+
+    @action(detail=False)
+    def metrics(self, request):
+        # totals since start in the Prometheus text format
+        if not INSTRUMENTATION_PROMETHEUS:
+            return Response({'errors': 'set INSTRUMENTATION_PROMETHEUS to enable'}, status=status.HTTP_404_NOT_FOUND)
+        return HttpResponse(recorder.prometheus(), content_type='text/plain; version=0.0.4')
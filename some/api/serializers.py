@@ -1,11 +1,13 @@
 import datetime
 
 from django.contrib.auth import authenticate
-from django.db.models import Q
+from django.db import transaction
 from django.utils import timezone
 from rest_framework import serializers
 
-from some.models import MyUser, Place, Film, Show, Order
+from some.instrumentation import TimedSerializerMixin
+from some.models import MyUser, Place, Film, Show, Order, SeatHold
+from some.overlap import overlap_index, overlapping
 
 
 class LoginUserSerializer(serializers.Serializer):
@@ -36,13 +38,13 @@ class RegSerializer(serializers.ModelSerializer):
         return user
 
 
-class PlaceSerializer(serializers.ModelSerializer):
+class PlaceSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Place
         fields = '__all__'
 
 
-class FilmSerializer(serializers.ModelSerializer):
+class FilmSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Film
         fields = '__all__'
@@ -53,20 +55,20 @@ class FilmSerializer(serializers.ModelSerializer):
         return data
 
 
-class DetailShowSerializer(serializers.ModelSerializer):
+class DetailShowSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     place = PlaceSerializer()
     film = FilmSerializer()
 
     class Meta:
         model = Show
-        fields = '__all__'
+        exclude = ('seats', )
 
 
-class ShowSerializer(serializers.ModelSerializer):
+class ShowSerializer(TimedSerializerMixin, serializers.ModelSerializer):
 
     class Meta:
         model = Show
-        fields = '__all__'
+        exclude = ('seats', )
         read_only_fields = ('busy', )
 
     def validate(self, cleaned_data):
@@ -96,12 +98,8 @@ class ShowSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError('can\'t buy more tickets than the size of place')
 
         if place and show_start and show_end:
-
-            q1 = Q(place=place, show_time_start__gte=show_start, show_time_start__lte=show_end)
-            q2 = Q(place=place, show_time_end__gte=show_start, show_time_end__lte=show_end)
-            query = Show.objects.filter(q1 | q2)
-
-            if len(query) and not self.instance or len(query) > 1:
+            exclude = self.instance.pk if self.instance else None
+            if overlap_index.conflict(place.id, show_start, show_end, exclude=exclude) is not None:
                 raise serializers.ValidationError("Some show is already set "
                                                   "in the same place simultaneously")
 
@@ -110,7 +108,11 @@ class ShowSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         place = validated_data.pop('place')
         film = validated_data.pop('film')
-        return Show.objects.create(place=place, film=film, **validated_data)
+        with transaction.atomic():
+            # validate() asked the index, which may miss shows written by other processes
+            if overlapping(place.id, validated_data['show_time_start'], validated_data['show_time_end']) is not None:
+                raise serializers.ValidationError("Some show is already set in the same place simultaneously")
+            return Show.objects.create(place=place, film=film, **validated_data)
 
     def update(self, instance, validated_data):
         instance.place = validated_data.get('place', instance.place)
@@ -128,7 +130,33 @@ class CreateOrderSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
-class SingleOrderSerializer(serializers.ModelSerializer):
+class ClaimSeatsSerializer(serializers.Serializer):
+    seats = serializers.ListField(child=serializers.ListField(child=serializers.IntegerField(min_value=1),
+                                                              min_length=2, max_length=2),
+                                  allow_empty=False)
+
+
+class CartItemSerializer(serializers.Serializer):
+    show = serializers.IntegerField()
+    amount = serializers.IntegerField(min_value=1)
+
+
+class CartSerializer(serializers.Serializer):
+    items = CartItemSerializer(many=True, allow_empty=False)
+
+    def validate_items(self, items):
+        if len(items) > 20:
+            raise serializers.ValidationError('no more than 20 shows at once')
+        return items
+
+
+class SeatHoldSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    class Meta:
+        model = SeatHold
+        exclude = ['user']
+
+
+class SingleOrderSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     show = ShowSerializer()
 
     class Meta:
@@ -136,7 +164,7 @@ class SingleOrderSerializer(serializers.ModelSerializer):
         exclude = ['user']
 
 
-class OrderSerializer(serializers.Serializer):
+class OrderSerializer(TimedSerializerMixin, serializers.Serializer):
     total = serializers.IntegerField()
     orders = SingleOrderSerializer(many=True)
 
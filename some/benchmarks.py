@@ -0,0 +1,192 @@
+import datetime
+import random
+import statistics
+import threading
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.db import connection
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from some import now_showing, schedule_cache
+from some.analytics import rebuild_analytics
+from some.api.custom_token import TemporaryToken
+from some.models import MyUser, Place, Film, Show, Order, SeatHold, SalesRollup, CalendarDay
+from some.overlap import overlap_index
+from some.spending import rebuild_spending
+
+PASSWORD = 'bench-password'
+ANY_USER = 'any'
+
+
+class Seed:
+    # realistic amounts of data created with bulk_create, every name starts with the prefix so it can be removed
+
+    def __init__(self, prefix, films=2000, places=200, shows=200000, orders=300000, users=5000, days=30,
+                 batch_size=5000, seed=0):
+        self.prefix = prefix
+        self.counts = {'films': films, 'places': places, 'shows': shows, 'orders': orders, 'users': users}
+        self.days = days
+        self.batch_size = batch_size
+        self.random = random.Random(seed)
+
+    def create(self):
+        today = datetime.date.today()
+        password = make_password(PASSWORD)
+        MyUser.objects.bulk_create((MyUser(username=f'{self.prefix}-user-{i}', password=password)
+                                    for i in range(self.counts['users'])), batch_size=self.batch_size)
+        Place.objects.bulk_create((Place(name=f'{self.prefix}-place-{i}', size=self.random.choice((50, 100, 200, 400)),
+                                         rows=10) for i in range(self.counts['places'])), batch_size=self.batch_size)
+        Film.objects.bulk_create((Film(name=f'{self.prefix}-film-{i}', begin=today - datetime.timedelta(days=7),
+                                       end=today + datetime.timedelta(days=self.days))
+                                  for i in range(self.counts['films'])), batch_size=self.batch_size)
+        self.users = list(self.users_queryset().order_by('id').values_list('id', flat=True))
+        self.places = list(Place.objects.filter(name__startswith=self.prefix).order_by('id').values_list('id', 'size'))
+        films = list(Film.objects.filter(name__startswith=self.prefix).values_list('id', flat=True))
+
+        # shows of a place follow each other every three hours from an hour ago on, tickets go to random shows
+        per_place = -(-self.counts['shows'] // len(self.places))
+        first = timezone.now() - datetime.timedelta(hours=1)
+        shows, sold = [], []
+        for place_id, size in self.places:
+            for slot in range(min(per_place, self.counts['shows'] - len(shows))):
+                start = first + datetime.timedelta(hours=3 * slot)
+                shows.append(Show(place_id=place_id, film_id=self.random.choice(films),
+                                  price=self.random.randrange(5, 30), show_time_start=start,
+                                  show_time_end=start + datetime.timedelta(hours=2)))
+                sold.append(size)
+        orders = []
+        for _ in range(self.counts['orders']):
+            index = self.random.randrange(len(shows))
+            amount = min(self.random.randint(1, 4), sold[index] - shows[index].busy)
+            if amount > 0:
+                shows[index].busy += amount
+                orders.append((index, amount))
+        Show.objects.bulk_create(shows, batch_size=self.batch_size)
+        ids = list(Show.objects.filter(place_id__in=[place_id for place_id, _ in self.places])
+                   .order_by('id').values_list('id', flat=True))
+        Order.objects.bulk_create((Order(show_id=ids[index], user_id=self.random.choice(self.users), amount=amount)
+                                   for index, amount in orders), batch_size=self.batch_size)
+        rebuild_spending(self.batch_size)
+        rebuild_analytics(self.batch_size)
+        # bulk_create sends no signals
+        now_showing.forget()
+        now_showing.materialize(count=self.days)
+        self.shows = ids
+        return self
+
+    def users_queryset(self):
+        return MyUser.objects.filter(username__startswith=f'{self.prefix}-user-')
+
+    def delete(self):
+        # orders don't cascade; shows go in one raw DELETE without a signal per show,
+        # what the signals keep up to date is rebuilt once at the end
+        shows = Show.objects.filter(place__name__startswith=self.prefix)
+        Order.objects.filter(show__in=shows).delete()
+        Order.objects.filter(user__in=self.users_queryset()).delete()
+        SeatHold.objects.filter(show__in=shows).delete()
+        SalesRollup.objects.filter(place__name__startswith=self.prefix).delete()
+        shows._raw_delete(shows.db)
+        Film.objects.filter(name__startswith=self.prefix).delete()
+        Place.objects.filter(name__startswith=self.prefix).delete()
+        self.users_queryset().delete()
+        rebuild_spending(self.batch_size)
+        rebuild_analytics(self.batch_size)
+        now_showing.rebuild(CalendarDay.objects.values_list('date', flat=True))
+        overlap_index.reset()
+        schedule_cache.invalidate()
+
+
+class Scenario:
+    # one kind of request, `request(client, rng)` sends it with the client of a driver thread;
+    # user is the id of the user sending it, ANY_USER for a random seeded user of each thread or None
+
+    def __init__(self, name, request, user=None):
+        self.name = name
+        self.request = request
+        self.user = user
+
+
+def scenarios(seed):
+    places = list(Place.objects.filter(name__startswith=seed.prefix).values_list('name', flat=True))
+    # the user with the longest order history
+    heavy = Order.objects.filter(user__in=seed.users_queryset()).values('user_id') \
+        .annotate(count=Count('id')).order_by('-count').values_list('user_id', flat=True).first()
+    # html pages have two shows, stay well within the schedule
+    pages = max(1, min(50, len(seed.shows) // 4))
+    return [
+        Scenario('show_list', lambda client, rng: client.get('/', {'sort': rng.choice(('date', 'price')),
+                                                                   'page': rng.randint(1, pages)})),
+        Scenario('api_shows', lambda client, rng: client.get('/api/shows/')),
+        Scenario('api_shows_filter', lambda client, rng: client.get('/api/shows/', {
+            'day': rng.choice(('today', 'tomorrow')), 'place': rng.choice(places), 'sort': 'price'})),
+        Scenario('create_order', lambda client, rng: client.post(
+            f'/api/shows/{rng.choice(seed.shows)}/create_order/', {'amount': 1}), user=ANY_USER),
+        Scenario('orders', lambda client, rng: client.get('/api/orders/'), user=heavy),
+        Scenario('auth_login', lambda client, rng: client.post('/api/auth/', {
+            'username': f'{seed.prefix}-user-{rng.randrange(len(seed.users))}', 'password': PASSWORD})),
+        Scenario('auth_token', lambda client, rng: client.get('/api/places/'), user=ANY_USER),
+    ]
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def run(scenario, seed, requests=200, threads=4, rng_seed=0):
+    # send `requests` requests from `threads` threads, each with its own client and connection;
+    # with one thread everything runs in the calling thread
+    latencies, queries, errors = [], [], []
+    lock = threading.Lock()
+    per_thread = -(-requests // threads)
+
+    def driver(number):
+        rng = random.Random(rng_seed + number)
+        client = APIClient()
+        if scenario.user is not None:
+            user_id = rng.choice(seed.users) if scenario.user == ANY_USER else scenario.user
+            token, created = TemporaryToken.objects.get_or_create(user_id=user_id)
+            client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        mine = ([], [], [])
+        for _ in range(per_thread):
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                try:
+                    response = scenario.request(client, rng)
+                    failed = response.status_code >= 400
+                except Exception:
+                    failed = True
+                elapsed = time.perf_counter() - started
+            mine[0].append(elapsed * 1000)
+            mine[1].append(len(captured))
+            mine[2].append(failed)
+        with lock:
+            latencies.extend(mine[0])
+            queries.extend(mine[1])
+            errors.extend(mine[2])
+        if threads > 1:
+            connection.close()
+
+    started = time.perf_counter()
+    if threads == 1:
+        driver(0)
+    else:
+        pool = [threading.Thread(target=driver, args=(number, )) for number in range(threads)]
+        for thread in pool:
+            thread.start()
+        for thread in pool:
+            thread.join()
+    elapsed = time.perf_counter() - started
+    return {
+        'requests': len(latencies),
+        'threads': threads,
+        'errors': sum(errors),
+        'requests_per_sec': round(len(latencies) / elapsed, 1),
+        'latency_ms': {'p50': round(percentile(latencies, 0.5), 2), 'p90': round(percentile(latencies, 0.9), 2),
+                       'p99': round(percentile(latencies, 0.99), 2), 'max': round(max(latencies), 2)},
+        'queries': {'mean': round(statistics.mean(queries), 2), 'max': max(queries)},
+    }
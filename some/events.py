@@ -0,0 +1,126 @@
+import asyncio
+import json
+import threading
+from collections import defaultdict
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from some.models import Show
+
+# in cinema/asgi.py: application = with_events(get_asgi_application())
+EVENTS_PATH = getattr(settings, 'EVENTS_PATH', '/api/events/')
+# a burst of purchases becomes at most one update per show per interval
+EVENTS_INTERVAL = getattr(settings, 'EVENTS_INTERVAL', 1.0)
+HEARTBEAT = 15
+MAX_SHOWS = 50
+
+
+class Broker:
+    # in-process fan-out of seat availability, fed by purchases from any thread of this process
+
+    def __init__(self, interval=EVENTS_INTERVAL):
+        self.interval = interval
+        self.pending = set()
+        self.lock = threading.Lock()
+        self.subscribers = defaultdict(set)
+        self.flusher = None
+
+    def publish(self, show_id):
+        # busy of the show changed, safe to call from sync code
+        with self.lock:
+            self.pending.add(show_id)
+
+    def subscribe(self, show_ids):
+        queue = asyncio.Queue()
+        for show_id in show_ids:
+            self.subscribers[show_id].add(queue)
+        if self.flusher is None or self.flusher.done():
+            self.flusher = asyncio.ensure_future(self.flush_forever())
+        return queue
+
+    def unsubscribe(self, queue, show_ids):
+        for show_id in show_ids:
+            self.subscribers[show_id].discard(queue)
+            if not self.subscribers[show_id]:
+                del self.subscribers[show_id]
+
+    async def flush_forever(self):
+        while self.subscribers:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    async def flush(self):
+        with self.lock:
+            changed, self.pending = self.pending, set()
+        wanted = [show_id for show_id in changed if show_id in self.subscribers]
+        if not wanted:
+            return
+        for event in await availability(wanted):
+            for queue in self.subscribers.get(event['show'], ()):
+                queue.put_nowait(event)
+
+
+@sync_to_async
+def availability(show_ids):
+    return [{'show': show_id, 'busy': busy, 'free': size - busy}
+            for show_id, busy, size in Show.objects.filter(id__in=show_ids)
+            .values_list('id', 'busy', 'place__size')]
+
+
+broker = Broker()
+
+
+async def disconnected(receive):
+    # the request body comes first, the stream ends when the client goes away
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def events_app(scope, receive, send):
+    # server-sent events with availability of ?shows=1,2,3, the current state first and then changes
+    query = parse_qs(scope.get('query_string', b'').decode())
+    try:
+        show_ids = {int(show_id) for value in query.get('shows', ()) for show_id in value.split(',') if show_id}
+    except ValueError:
+        show_ids = set()
+    if not show_ids or len(show_ids) > MAX_SHOWS:
+        await send({'type': 'http.response.start', 'status': 400,
+                    'headers': [(b'content-type', b'text/plain')]})
+        await send({'type': 'http.response.body', 'body': f'pass up to {MAX_SHOWS} ids as ?shows='.encode()})
+        return
+
+    await send({'type': 'http.response.start', 'status': 200,
+                'headers': [(b'content-type', b'text/event-stream'), (b'cache-control', b'no-cache')]})
+    queue = broker.subscribe(show_ids)
+    disconnect = asyncio.ensure_future(disconnected(receive))
+    try:
+        for event in await availability(list(show_ids)):
+            queue.put_nowait(event)
+        while True:
+            get = asyncio.ensure_future(queue.get())
+            done, _ = await asyncio.wait({get, disconnect}, timeout=HEARTBEAT, return_when=asyncio.FIRST_COMPLETED)
+            if disconnect in done:
+                get.cancel()
+                break
+            if get in done:
+                body = f'data: {json.dumps(get.result())}\n\n'
+            else:
+                get.cancel()
+                body = ': heartbeat\n\n'
+            await send({'type': 'http.response.body', 'body': body.encode(), 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        broker.unsubscribe(queue, show_ids)
+        disconnect.cancel()
+
+
+def with_events(application):
+    # serve EVENTS_PATH from events_app and everything else from the django application
+    async def app(scope, receive, send):
+        if scope['type'] == 'http' and scope['path'] == EVENTS_PATH:
+            await events_app(scope, receive, send)
+        else:
+            await application(scope, receive, send)
+    return app
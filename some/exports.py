@@ -0,0 +1,45 @@
+import csv
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from some.models import Order
+
+SALES_FIELDS = ('id', 'user_id', 'user__username', 'amount', 'show_id', 'show__show_time_start',
+                'show__show_time_end', 'show__price', 'show__film__name', 'show__place__name')
+SALES_HEADER = ('order', 'user', 'username', 'amount', 'show', 'show_time_start',
+                'show_time_end', 'price', 'film', 'place')
+CHUNK_SIZE = 2000
+
+
+def sales(date=None, chunk_size=CHUNK_SIZE):
+    # every order joined with its show, film and place as plain tuples, read in chunks
+    queryset = Order.objects.order_by('id')
+    if date is not None:
+        queryset = queryset.filter(show__show_time_start__date=date)
+    return queryset.values_list(*SALES_FIELDS).iterator(chunk_size=chunk_size)
+
+
+class Echo:
+    # csv.writer target that hands the written line back instead of keeping it
+
+    def write(self, value):
+        return value
+
+
+def sales_csv(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(SALES_HEADER)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def sales_ndjson(rows):
+    encoder = DjangoJSONEncoder()
+    for row in rows:
+        yield encoder.encode(dict(zip(SALES_HEADER, row))) + '\n'
+
+
+FORMATS = {
+    'csv': (sales_csv, 'text/csv'),
+    'ndjson': (sales_ndjson, 'application/x-ndjson'),
+}
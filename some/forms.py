@@ -1,8 +1,8 @@
 from django import forms
-from django.db.models import Q
 from django.core.exceptions import ValidationError
 from django.forms import ModelForm
 from some.models import Film, Place, Show, Order, MyUser
+from some.overlap import overlap_index
 import datetime as dt
 
 
@@ -71,11 +71,7 @@ class ShowForm(ModelForm):
             raise ValidationError('show must be held during film period')
 
         place = cleaned_data.get('place')
-        q1 = Q(place=place, show_time_start__gte=start, show_time_start__lte=end)
-        q2 = Q(place=place, show_time_end__gte=start, show_time_end__lte=end)
-        query = Show.objects.filter(q1 | q2)
-
-        if len(query) and not self.instance.pk or len(query) > 1:
+        if overlap_index.conflict(place.id, start, end, exclude=self.instance.pk) is not None:
             raise ValidationError("Some show is already set in the same place simultaneously")
 
 
@@ -0,0 +1,89 @@
+import datetime
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction, close_old_connections
+from django.db.models import F, Case, When, Value, IntegerField
+from django.utils import timezone
+
+from some.models import Show, SeatHold
+from some.reservations import seats_changed, sell, take_seats
+
+# how long held seats wait for the payment
+SEAT_HOLD_TIME = getattr(settings, 'SEAT_HOLD_TIME', datetime.timedelta(minutes=10))
+
+
+def hold_seats(show_id, user_id, amount, duration=SEAT_HOLD_TIME):
+    # take `amount` seats like reserve_seats does, but without an order yet,
+    # returns created SeatHold or None if the hall is full
+    with transaction.atomic():
+        if not take_seats(show_id, amount):
+            return None
+        seats_changed(show_id)
+        return SeatHold.objects.create(show_id=show_id, user_id=user_id, amount=amount,
+                                       expires=timezone.now() + duration)
+
+
+def take_hold(hold_id, user_id, active=True):
+    # delete the hold of the user and return it, None if it is gone or was taken by a concurrent request;
+    # an active hold must not be expired yet
+    holds = SeatHold.objects.filter(id=hold_id, user_id=user_id)
+    if active:
+        holds = holds.filter(expires__gt=timezone.now())
+    hold = holds.first()
+    if hold is None or not SeatHold.objects.filter(id=hold.id).delete()[0]:
+        return None
+    return hold
+
+
+def confirm_hold(hold_id, user_id):
+    # turn an unexpired hold into an order, its seats are already in busy
+    with transaction.atomic():
+        hold = take_hold(hold_id, user_id)
+        if hold is None:
+            return None
+        return sell(hold.show_id, user_id, hold.amount)
+
+
+def release_hold(hold_id, user_id):
+    # give the seats back, returns False if there was nothing to release
+    with transaction.atomic():
+        hold = take_hold(hold_id, user_id, active=False)
+        if hold is None:
+            return False
+        Show.objects.filter(id=hold.show_id).update(busy=F('busy') - hold.amount)
+        seats_changed(hold.show_id)
+        return True
+
+
+def release_expired(batch_size=500):
+    # release expired holds, a batch per transaction with one UPDATE of busy for all its shows;
+    # returns the number of released holds
+    released = 0
+    while True:
+        with transaction.atomic():
+            batch = list(SeatHold.objects.filter(expires__lte=timezone.now()).order_by('expires')
+                         .select_for_update(skip_locked=True).values_list('id', 'show_id', 'amount')[:batch_size])
+            if not batch:
+                return released
+            SeatHold.objects.filter(id__in=[hold_id for hold_id, _, _ in batch]).delete()
+            seats = Counter()
+            for _, show_id, amount in batch:
+                seats[show_id] += amount
+            Show.objects.filter(id__in=seats).update(
+                busy=F('busy') - Case(*(When(id=show_id, then=Value(amount)) for show_id, amount in seats.items()),
+                                      output_field=IntegerField()))
+            for show_id in seats:
+                seats_changed(show_id)
+        released += len(batch)
+
+
+def sweep_forever(interval, batch_size=500, log=None):
+    # the loop of the sweeper daemon
+    while True:
+        close_old_connections()
+        released = release_expired(batch_size)
+        if released and log:
+            log(f'{released} expired holds released')
+        time.sleep(interval)
@@ -0,0 +1,77 @@
+import datetime
+import json
+from functools import wraps
+
+from django.conf import settings
+from django.db import transaction, IntegrityError
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+from some.models import IdempotencyKey
+
+HEADER = 'HTTP_IDEMPOTENCY_KEY'
+# how long a stored response answers retries of the same key
+IDEMPOTENCY_TTL = getattr(settings, 'IDEMPOTENCY_TTL', datetime.timedelta(hours=24))
+
+
+def replay(stored, path):
+    if stored.path != path:
+        return Response({'idempotency error': 'key was used for another request'},
+                        status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+    if stored.status is None:
+        # the first request with this key hasn't finished
+        return Response({'idempotency error': 'request with this key is in progress'},
+                        status=status.HTTP_409_CONFLICT)
+    response = Response(json.loads(stored.body), status=stored.status)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(view_method):
+    # answers a request carrying an Idempotency-Key the user already sent with the stored response,
+    # before the view reads anything; the key and the work of the view are committed together
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.META.get(HEADER)
+        if not key or request.method in ('GET', 'HEAD', 'OPTIONS') or not request.user.is_authenticated:
+            return view_method(self, request, *args, **kwargs)
+        if len(key) > IdempotencyKey._meta.get_field('key').max_length:
+            return Response({'idempotency error': 'key is too long'}, status=status.HTTP_400_BAD_REQUEST)
+
+        now = timezone.now()
+        stored = IdempotencyKey.objects.filter(user=request.user, key=key, expires__gt=now).first()
+        if stored is not None:
+            return replay(stored, request.path)
+        try:
+            with transaction.atomic():
+                IdempotencyKey.objects.filter(user=request.user, key=key, expires__lte=now).delete()
+                stored = IdempotencyKey.objects.create(user=request.user, key=key, path=request.path,
+                                                       expires=now + IDEMPOTENCY_TTL)
+                response = view_method(self, request, *args, **kwargs)
+                if response.status_code < 500:
+                    stored.status = response.status_code
+                    stored.body = json.dumps(response.data, cls=JSONEncoder)
+                    stored.save(update_fields=('status', 'body'))
+                else:
+                    stored.delete()
+                return response
+        except IntegrityError:
+            # a concurrent request with the same key got there first
+            stored = IdempotencyKey.objects.filter(user=request.user, key=key).first()
+            if stored is None:
+                raise
+            return replay(stored, request.path)
+    return wrapper
+
+
+def purge_expired(batch_size=1000):
+    # delete expired keys in batches, returns how many were deleted
+    deleted = 0
+    while True:
+        ids = list(IdempotencyKey.objects.filter(expires__lte=timezone.now())
+                   .values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        deleted += IdempotencyKey.objects.filter(id__in=ids).delete()[0]
@@ -0,0 +1,203 @@
+import bisect
+import cProfile
+import heapq
+import io
+import itertools
+import pstats
+import random
+import threading
+import time
+from collections import deque, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+
+# samples of the last requests kept for the histograms
+INSTRUMENTATION_BUFFER = getattr(settings, 'INSTRUMENTATION_BUFFER', 10000)
+# share of requests run under cProfile, 0 turns profiling off
+INSTRUMENTATION_PROFILE_RATE = getattr(settings, 'INSTRUMENTATION_PROFILE_RATE', 0)
+# how many of the slowest profiled requests are kept
+INSTRUMENTATION_PROFILES = getattr(settings, 'INSTRUMENTATION_PROFILES', 10)
+# serve the totals in the Prometheus text format at api/instrumentation/metrics/
+INSTRUMENTATION_PROMETHEUS = getattr(settings, 'INSTRUMENTATION_PROMETHEUS', False)
+
+# upper bounds of the wall time buckets, in milliseconds
+BUCKETS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+current = ContextVar('instrumentation_sample', default=None)
+
+
+class Sample:
+    # measurements of one request, filled by the middleware, the query wrapper and the serializers
+    __slots__ = ('view', 'method', 'status', 'wall', 'queries', 'db', 'serializer', 'depth', 'at')
+
+    def __init__(self, method):
+        self.method = method
+        self.view = None
+        self.status = None
+        self.wall = 0.0
+        self.queries = 0
+        self.db = 0.0
+        self.serializer = 0.0
+        self.depth = 0
+        self.at = time.time()
+
+    def __call__(self, execute, sql, params, many, context):
+        # connection.execute_wrapper hook
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.db += time.perf_counter() - started
+
+    def as_dict(self):
+        return {'view': self.view, 'method': self.method, 'status': self.status, 'at': self.at,
+                'wall_ms': round(self.wall * 1000, 3), 'queries': self.queries,
+                'db_ms': round(self.db * 1000, 3), 'serializer_ms': round(self.serializer * 1000, 3)}
+
+
+@contextmanager
+def timed_serialization():
+    # count the time of the outermost serialization of the current request
+    sample = current.get()
+    if sample is None or sample.depth:
+        yield
+        return
+    sample.depth += 1
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        sample.serializer += time.perf_counter() - started
+        sample.depth -= 1
+
+
+class TimedSerializerMixin:
+    # for serializers of responses, nested ones are counted as part of their parent
+
+    def to_representation(self, instance):
+        with timed_serialization():
+            return super().to_representation(instance)
+
+
+class Recorder:
+    # ring buffer of the last samples, totals since start for Prometheus and the slowest profiles
+
+    def __init__(self, size=INSTRUMENTATION_BUFFER, profiles=INSTRUMENTATION_PROFILES):
+        self.samples = deque(maxlen=size)
+        self.lock = threading.Lock()
+        # view -> bucket counts, the last one for slower requests, then count, wall, queries, db and serializer sums
+        self.totals = defaultdict(lambda: [0] * (len(BUCKETS) + 6))
+        self.profiles = []
+        self.keep_profiles = profiles
+        self.profiling = threading.Lock()
+        self.order = itertools.count()
+
+    def add(self, sample, profile=None):
+        self.samples.append(sample)
+        with self.lock:
+            total = self.totals[sample.view]
+            total[bisect.bisect_left(BUCKETS, sample.wall * 1000)] += 1
+            for index, value in enumerate((1, sample.wall, sample.queries, sample.db, sample.serializer),
+                                          start=len(BUCKETS) + 1):
+                total[index] += value
+            if profile is not None:
+                entry = (sample.wall, next(self.order), sample, profile)
+                if len(self.profiles) < self.keep_profiles:
+                    heapq.heappush(self.profiles, entry)
+                else:
+                    heapq.heappushpop(self.profiles, entry)
+
+    @contextmanager
+    def profile(self, rate=INSTRUMENTATION_PROFILE_RATE):
+        # yields a running cProfile.Profile for a sampled request, None otherwise;
+        # one request at a time, the interpreter allows a single active profiler
+        if not rate or random.random() >= rate or not self.profiling.acquire(blocking=False):
+            yield None
+            return
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            self.profiling.release()
+            yield None
+            return
+        try:
+            yield profiler
+        finally:
+            profiler.disable()
+            self.profiling.release()
+
+    def histograms(self):
+        # per view over the ring buffer: wall time buckets, percentiles and means of the other measurements
+        views = defaultdict(list)
+        for sample in list(self.samples):
+            views[sample.view].append(sample)
+        result = {}
+        for view, samples in sorted(views.items(), key=lambda item: str(item[0])):
+            walls = sorted(sample.wall * 1000 for sample in samples)
+            counts = [0] * (len(BUCKETS) + 1)
+            for wall in walls:
+                counts[bisect.bisect_left(BUCKETS, wall)] += 1
+            result[view] = {
+                'requests': len(samples),
+                'wall_ms': {'p50': percentile(walls, 0.5), 'p90': percentile(walls, 0.9),
+                            'p99': percentile(walls, 0.99), 'max': round(walls[-1], 3)},
+                'buckets': dict(zip([str(bound) for bound in BUCKETS] + ['+Inf'], counts)),
+                'queries': mean(sample.queries for sample in samples),
+                'db_ms': mean(sample.db * 1000 for sample in samples),
+                'serializer_ms': mean(sample.serializer * 1000 for sample in samples),
+            }
+        return result
+
+    def slowest(self, limit=40):
+        # profiled requests from the slowest, with the top of their cumulative stats
+        result = []
+        with self.lock:
+            profiles = sorted(self.profiles, reverse=True)
+        for wall, _, sample, profile in profiles:
+            text = io.StringIO()
+            pstats.Stats(profile, stream=text).sort_stats('cumulative').print_stats(limit)
+            result.append(dict(sample.as_dict(), profile=text.getvalue()))
+        return result
+
+    def prometheus(self):
+        lines = ['# TYPE cinema_request_duration_seconds histogram']
+        sums = []
+        with self.lock:
+            totals = {view: list(total) for view, total in self.totals.items()}
+        for view, total in sorted(totals.items(), key=lambda item: str(item[0])):
+            label = str(view).replace('\\', '\\\\').replace('"', '\\"')
+            cumulative = 0
+            for bound, count in zip([str(bound / 1000) for bound in BUCKETS] + ['+Inf'], total):
+                cumulative += count
+                lines.append(f'cinema_request_duration_seconds_bucket{{view="{label}",le="{bound}"}} {cumulative}')
+            count, wall, queries, db, serializer = total[len(BUCKETS) + 1:]
+            lines.append(f'cinema_request_duration_seconds_sum{{view="{label}"}} {wall}')
+            lines.append(f'cinema_request_duration_seconds_count{{view="{label}"}} {count}')
+            sums.append((label, queries, db, serializer))
+        for name, kind, index in (('cinema_db_queries_total', 'counter', 1), ('cinema_db_seconds_total', 'counter', 2),
+                                  ('cinema_serializer_seconds_total', 'counter', 3)):
+            lines.append(f'# TYPE {name} {kind}')
+            lines += [f'{name}{{view="{row[0]}"}} {row[index]}' for row in sums]
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        with self.lock:
+            self.samples.clear()
+            self.totals.clear()
+            self.profiles = []
+
+
+def percentile(values, fraction):
+    return round(values[min(len(values) - 1, int(fraction * len(values)))], 3)
+
+
+def mean(values):
+    values = list(values)
+    return round(sum(values) / len(values), 3)
+
+
+recorder = Recorder()
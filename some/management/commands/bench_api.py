@@ -0,0 +1,47 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from some.benchmarks import Seed, scenarios, run
+
+
+class Command(BaseCommand):
+    help = 'Seed a realistic schedule, measure latency and queries per request of the main endpoints, print JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--films', type=int, default=2000)
+        parser.add_argument('--places', type=int, default=200)
+        parser.add_argument('--shows', type=int, default=200000)
+        parser.add_argument('--orders', type=int, default=300000)
+        parser.add_argument('--users', type=int, default=5000)
+        parser.add_argument('--requests', type=int, default=200, help='requests per scenario')
+        parser.add_argument('--threads', type=int, default=4)
+        parser.add_argument('--only', nargs='*', help='names of scenarios to run')
+        parser.add_argument('--output', help='file for the results instead of stdout')
+        parser.add_argument('--keep', action='store_true', help="don't delete the seeded data")
+
+    def handle(self, *args, **options):
+        prefix = 'bench-' + timezone.now().strftime('%Y%m%d%H%M%S')
+        seed = Seed(prefix, films=options['films'], places=options['places'], shows=options['shows'],
+                    orders=options['orders'], users=options['users'])
+        started = timezone.now()
+        try:
+            # a seed that was interrupted is removed as well
+            seed.create()
+            self.stderr.write(f'seeded {seed.counts} in {(timezone.now() - started).total_seconds():.1f}s')
+            results = {'seed': seed.counts, 'scenarios': {}}
+            for scenario in scenarios(seed):
+                if options['only'] and scenario.name not in options['only']:
+                    continue
+                results['scenarios'][scenario.name] = run(scenario, seed, options['requests'], options['threads'])
+                self.stderr.write(f"{scenario.name}: {results['scenarios'][scenario.name]['latency_ms']}")
+        finally:
+            if not options['keep']:
+                seed.delete()
+        output = json.dumps(results, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output + '\n')
+        else:
+            self.stdout.write(output)
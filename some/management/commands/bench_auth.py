@@ -0,0 +1,47 @@
+import datetime
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory
+
+from some.api.custom_authentication import TemporaryTokenAuthentication
+from some.api.custom_token import TemporaryToken
+from some.api.resources import PlaceViewSet
+from some.models import MyUser
+
+
+class WriteEveryRequest(TemporaryTokenAuthentication):
+    # how it worked before: no cache and last_action saved on each request
+    activity_granularity = datetime.timedelta(0)
+    cache = None
+
+
+class Command(BaseCommand):
+    help = 'Compare authenticated GET api/places/ throughput with and without sliding token writes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            stamp = timezone.now().strftime('%Y%m%d%H%M%S%f')
+            user = MyUser.objects.create_user(username=f'bench-{stamp}', password=stamp)
+            token, created = TemporaryToken.objects.get_or_create(user=user)
+            for authentication in (WriteEveryRequest, TemporaryTokenAuthentication):
+                self.bench(authentication, token.key, options['requests'])
+            transaction.set_rollback(True)
+
+    def bench(self, authentication, key, count):
+        factory = APIRequestFactory()
+        view = PlaceViewSet.as_view({'get': 'list'}, authentication_classes=(authentication,))
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            for _ in range(count):
+                view(factory.get('/api/places/', HTTP_AUTHORIZATION=f'Token {key}'))
+            elapsed = time.perf_counter() - started
+        writes = sum(query['sql'].startswith('UPDATE') for query in queries)
+        self.stdout.write(f'{authentication.__name__}: {count / elapsed:.0f} requests/sec, '
+                          f'{len(queries) / count:.2f} queries and {writes} token writes per {count} requests')
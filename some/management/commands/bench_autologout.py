@@ -0,0 +1,69 @@
+import datetime
+import time
+from importlib import import_module
+
+from django.conf import settings
+from django.contrib.auth import logout
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.core.management.base import BaseCommand
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django.utils import timezone
+
+from cinema.settings import TIME_TO_LOGOUT
+from some.middleware import AutoLogout
+from some.models import MyUser
+
+
+class StrftimeAutoLogout(AutoLogout):
+    # how it worked before: formatted time written to the session on every request
+
+    def process_request(self, request):
+        if request.user.is_authenticated and not request.user.is_superuser:
+            form = "%Y %m %d %H:%M:%S"
+            user_time = request.session.get('time')
+            if user_time:
+                user_time = datetime.datetime.strptime(user_time, form)
+                if datetime.datetime.now() - user_time < TIME_TO_LOGOUT:
+                    request.session['time'] = timezone.now().strftime(form)
+                else:
+                    logout(request)
+            else:
+                request.session['time'] = datetime.datetime.now().strftime(form)
+
+
+class Command(BaseCommand):
+    help = 'Simulate a user browsing pages and count session writes made by the AutoLogout middleware'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        user = MyUser(id=0, username='bench')
+        for middleware in (StrftimeAutoLogout, AutoLogout):
+            self.bench(middleware, user, options['requests'])
+
+    def bench(self, middleware, user, count):
+        engine = import_module(settings.SESSION_ENGINE)
+        factory = RequestFactory()
+        writes = 0
+        session_key = None
+
+        def view(request):
+            return HttpResponse()
+
+        stack = SessionMiddleware(middleware(view))
+        started = time.perf_counter()
+        for _ in range(count):
+            request = factory.get('/')
+            request.user = user
+            request.session = engine.SessionStore(session_key)
+            response = stack.get_response(request)
+            writes += request.session.modified
+            stack.process_response(request, response)
+            session_key = request.session.session_key
+        elapsed = time.perf_counter() - started
+        if session_key:
+            engine.SessionStore(session_key).delete()
+        self.stdout.write(f'{middleware.__name__}: {count / elapsed:.0f} requests/sec, '
+                          f'{writes} session writes per {count} requests')
@@ -0,0 +1,74 @@
+import datetime
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory
+
+from some import schedule_cache
+from some.api.paginators import StandardResultsSetPagination
+from some.api.resources import ShowViewSet
+from some.models import Place, Film, Show
+
+
+class OffsetShowViewSet(ShowViewSet):
+    # the show listing paginated with page numbers, in the order cursor pagination uses
+    pagination_class = StandardResultsSetPagination
+
+    def get_queryset(self):
+        return super().get_queryset().order_by('show_time_start', 'id')
+
+
+class Command(BaseCommand):
+    help = 'Compare latency of the first and a deep page of api/shows/ with cursor and offset pagination'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', type=int, default=1000)
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        # everything seeded here is rolled back at the end
+        with transaction.atomic():
+            self.seed(options['pages'] * ShowViewSet.pagination_class.page_size)
+            self.bench(options['pages'], options['repeat'])
+            transaction.set_rollback(True)
+
+    def seed(self, count):
+        stamp = timezone.now().strftime('%Y%m%d%H%M%S%f')
+        today = datetime.date.today()
+        place = Place.objects.create(name=f'bench-{stamp}', size=100)
+        film = Film.objects.create(name=f'bench-{stamp}', begin=today, end=today + datetime.timedelta(days=365))
+        # all shows tomorrow, so ?day=tomorrow lists every one of them
+        start = timezone.make_aware(datetime.datetime.combine(today + datetime.timedelta(days=1), datetime.time()))
+        Show.objects.bulk_create((Show(place=place, film=film, price=i % 100 + 1,
+                                       show_time_start=start + datetime.timedelta(seconds=i),
+                                       show_time_end=start + datetime.timedelta(seconds=i + 1))
+                                  for i in range(count)), batch_size=1000)
+
+    def timed(self, func, repeat):
+        timings = []
+        for _ in range(repeat):
+            schedule_cache.invalidate()
+            started = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - started)
+        return sorted(timings)[len(timings) // 2] * 1000
+
+    def bench(self, pages, repeat):
+        factory = APIRequestFactory()
+        view = ShowViewSet.as_view({'get': 'list'})
+        url = first = '/api/shows/?day=tomorrow'
+        for _ in range(pages - 1):
+            url = view(factory.get(url)).data['next']
+
+        cursor_first = self.timed(lambda: view(factory.get(first)).render(), repeat)
+        cursor_deep = self.timed(lambda: view(factory.get(url)).render(), repeat)
+
+        # the same view and serializer, only the paginator differs
+        offset_view = OffsetShowViewSet.as_view({'get': 'list'})
+        offset_first = self.timed(lambda: offset_view(factory.get(first)).render(), repeat)
+        offset_deep = self.timed(lambda: offset_view(factory.get(f'{first}&page={pages}')).render(), repeat)
+
+        self.stdout.write(f'cursor: page 1 {cursor_first:.2f}ms, page {pages} {cursor_deep:.2f}ms')
+        self.stdout.write(f'offset: page 1 {offset_first:.2f}ms, page {pages} {offset_deep:.2f}ms')
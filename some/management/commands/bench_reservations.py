@@ -0,0 +1,75 @@
+import datetime
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, OperationalError
+from django.db.models import Sum
+from django.utils import timezone
+
+from some.models import MyUser, Place, Film, Show, Order
+from some.reservations import reserve_seats
+
+
+class Command(BaseCommand):
+    help = 'Hammer one show with concurrent reservations and check that nothing is oversold'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--attempts', type=int, default=100, help='reservations per thread')
+        parser.add_argument('--size', type=int, default=500, help='size of the hall')
+        parser.add_argument('--amount', type=int, default=1, help='tickets per reservation')
+
+    def handle(self, *args, **options):
+        stamp = timezone.now().strftime('%Y%m%d%H%M%S%f')
+        today = datetime.date.today()
+        user = MyUser.objects.create_user(username=f'bench-{stamp}', password=stamp)
+        place = Place.objects.create(name=f'bench-{stamp}', size=options['size'])
+        film = Film.objects.create(name=f'bench-{stamp}', begin=today, end=today + datetime.timedelta(days=1))
+        show = Show.objects.create(place=place, film=film, price=1,
+                                   show_time_start=timezone.now() + datetime.timedelta(hours=1),
+                                   show_time_end=timezone.now() + datetime.timedelta(hours=3))
+        results = {'ok': 0, 'full': 0, 'errors': 0}
+        lock = threading.Lock()
+
+        def worker():
+            counts = {'ok': 0, 'full': 0, 'errors': 0}
+            for _ in range(options['attempts']):
+                try:
+                    if reserve_seats(show.id, user.id, options['amount']) is None:
+                        counts['full'] += 1
+                    else:
+                        counts['ok'] += 1
+                except OperationalError:
+                    # sqlite answers concurrent writers with "database is locked"
+                    counts['errors'] += 1
+            connection.close()
+            with lock:
+                for key, value in counts.items():
+                    results[key] += value
+
+        threads = [threading.Thread(target=worker) for _ in range(options['threads'])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        show.refresh_from_db()
+        sold = Order.objects.filter(show=show).aggregate(Sum('amount')).get('amount__sum') or 0
+        self.stdout.write(f"orders: {results['ok']}, rejected as full: {results['full']}, "
+                          f"db errors: {results['errors']}")
+        self.stdout.write(f'busy: {show.busy}, sold: {sold}, size: {place.size}')
+        self.stdout.write(f"{results['ok'] / elapsed:.1f} orders/sec in {elapsed:.2f}s")
+
+        Order.objects.filter(show=show).delete()
+        show.delete()
+        film.delete()
+        place.delete()
+        user.delete()
+
+        if show.busy != sold or sold > place.size:
+            self.stderr.write('oversold!')
+            raise SystemExit(1)
+        self.stdout.write(self.style.SUCCESS('no oversell'))
@@ -0,0 +1,52 @@
+import datetime
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from some.api.fast_serializers import show_plan
+from some.api.serializers import DetailShowSerializer
+from some.models import Place, Film, Show
+
+
+class Command(BaseCommand):
+    help = 'Compare DetailShowSerializer with the values() field plan on many shows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shows', type=int, default=10000)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        # everything seeded here is rolled back at the end
+        with transaction.atomic():
+            stamp = timezone.now().strftime('%Y%m%d%H%M%S%f')
+            today = datetime.date.today()
+            place = Place.objects.create(name=f'bench-{stamp}', size=100, rows=10)
+            film = Film.objects.create(name=f'bench-{stamp}', begin=today, end=today + datetime.timedelta(days=30))
+            start = timezone.now() + datetime.timedelta(days=1)
+            Show.objects.bulk_create((Show(place=place, film=film, price=i % 100 + 1,
+                                           show_time_start=start + datetime.timedelta(minutes=i),
+                                           show_time_end=start + datetime.timedelta(minutes=i + 1))
+                                      for i in range(options['shows'])), batch_size=1000)
+            queryset = Show.objects.filter(place=place).order_by('id')
+            instances = list(queryset.select_related('place', 'film'))
+            rows = list(queryset.values(*show_plan.fields))
+            transaction.set_rollback(True)
+
+        renderer = JSONRenderer()
+        slow = self.timed(lambda: DetailShowSerializer(instances, many=True).data, options['repeat'])
+        fast = self.timed(lambda: show_plan.build_many(rows), options['repeat'])
+        same = renderer.render(DetailShowSerializer(instances, many=True).data) == \
+            renderer.render(show_plan.build_many(rows))
+        self.stdout.write(f"{options['shows']} shows: serializer {slow:.1f}ms, field plan {fast:.1f}ms, "
+                          f"{slow / fast:.1f}x faster, identical JSON: {same}")
+
+    def timed(self, func, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - started)
+        return min(timings) * 1000
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from some.now_showing import materialize, CALENDAR_MAX_DAYS
+
+
+class Command(BaseCommand):
+    help = 'Materialize the calendar days from today on that are not saved yet, run it daily'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=CALENDAR_MAX_DAYS)
+
+    def handle(self, *args, **options):
+        saved = materialize(count=options['days'])
+        self.stdout.write(f'{saved} calendar days materialized')
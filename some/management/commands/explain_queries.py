@@ -0,0 +1,65 @@
+import datetime
+import re
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import RequestFactory
+from django.utils import timezone
+from rest_framework.request import Request
+
+from some.api.resources import ShowViewSet, PlaceViewSet, OrderListAPIView
+from some.models import MyUser, Place, Show, Order
+from some.overlap import intersecting
+from some.views import ShowList, OrderListView
+
+# plan lines saying a whole table is read, by sqlite or postgresql
+FULL_SCAN = re.compile(r'\bSCAN (?:TABLE )?(?!CONSTANT|SUBQUERY)(\w+)|Seq Scan on (\w+)')
+
+
+class Command(BaseCommand):
+    help = 'Run EXPLAIN over the queries of the schedule and order listings and report full table scans'
+
+    def viewset_queryset(self, viewset, params, action='list', user=None):
+        view = viewset(action=action, format_kwarg=None)
+        view.request = Request(RequestFactory().get('/', params))
+        if user is not None:
+            view.request.user = user
+        return view.filter_queryset(view.get_queryset())
+
+    def html_queryset(self, view_class, params, user=None):
+        view = view_class()
+        view.request = RequestFactory().get('/', params)
+        view.request.user = user
+        view.kwargs = {}
+        return view.get_queryset()
+
+    def queries(self):
+        user = MyUser(id=1)
+        place = Place(id=1, name='')
+        now = timezone.now()
+        yield 'api shows', self.viewset_queryset(ShowViewSet, {})
+        yield 'api shows today by price', self.viewset_queryset(ShowViewSet, {'day': 'today', 'sort': 'price'})
+        yield 'api shows tomorrow from 18', self.viewset_queryset(ShowViewSet, {'day': 'tomorrow', 'start': 18})
+        yield 'api shows of place', self.viewset_queryset(ShowViewSet, {'place': 'name'})
+        yield 'api places', self.viewset_queryset(PlaceViewSet, {})
+        yield 'api orders', self.viewset_queryset(OrderListAPIView, {}, user=user).order_by('-id')
+        yield 'html shows', self.html_queryset(ShowList, {})
+        yield 'html shows today', self.html_queryset(ShowList, {'date': 'today'})
+        yield 'html orders', self.html_queryset(OrderListView, {}, user=user)
+        yield 'show overlap', intersecting(place.id, now, now + datetime.timedelta(hours=3))
+        yield 'place max busy', Show.objects.filter(place=place).values('busy')
+        yield 'orders total', Order.objects.filter(user=user).values('amount', 'show__price')
+
+    def handle(self, *args, **options):
+        scans = 0
+        for name, queryset in self.queries():
+            plan = queryset.explain()
+            tables = [sqlite or postgresql for sqlite, postgresql in FULL_SCAN.findall(plan)]
+            if tables:
+                scans += 1
+                self.stdout.write(self.style.WARNING(f"{name}: full scan of {', '.join(tables)}"))
+            else:
+                self.stdout.write(f'{name}: ok')
+            if options['verbosity'] > 1:
+                self.stdout.write(plan)
+        self.stdout.write(f'{scans} of the queries read whole tables on {connection.vendor}')
@@ -0,0 +1,35 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from some.exports import sales, FORMATS, CHUNK_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Write every order joined with its show, film and place as CSV or NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default='-', help="file to write, '-' for stdout")
+        parser.add_argument('--format', choices=FORMATS, default='csv')
+        parser.add_argument('--date', help='only shows starting that day, YYYY-MM-DD')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        date = options['date']
+        if date is not None:
+            try:
+                date = parse_date(date)
+            except ValueError:
+                date = None
+            if date is None:
+                raise CommandError('date must look like YYYY-MM-DD')
+        writer, content_type = FORMATS[options['format']]
+        path = options['output']
+        target = sys.stdout if path == '-' else open(path, 'w', newline='', encoding='utf-8')
+        try:
+            for line in writer(sales(date, options['chunk_size'])):
+                target.write(line)
+        finally:
+            if target is not sys.stdout:
+                target.close()
@@ -0,0 +1,41 @@
+import csv
+import sys
+import time
+from contextlib import nullcontext
+
+from django.core.management.base import BaseCommand, CommandError
+
+from some.schedule_import import ScheduleImport, read_csv, read_json, BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Create shows from a CSV or JSON schedule, columns: ' \
+           'place, film, show_time_start, show_time_end, price'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="schedule file, '-' for stdin")
+        parser.add_argument('--format', choices=('csv', 'json'),
+                            help='defaults to the file extension, json for stdin')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--dry-run', action='store_true', help='only validate the schedule')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or ('csv' if path.endswith('.csv') else 'json')
+        started = time.perf_counter()
+        try:
+            # stdin is left open
+            source = nullcontext(sys.stdin) if path == '-' else open(path, newline='', encoding='utf-8')
+        except OSError as e:
+            raise CommandError(e)
+        with source as file:
+            rows = read_csv(file) if file_format == 'csv' else read_json(file)
+            try:
+                created, errors = ScheduleImport(options['batch_size']).run(rows, dry_run=options['dry_run'])
+            except (ValueError, csv.Error) as e:
+                raise CommandError(f'cant read schedule: {e}')
+        for number, row_errors in sorted(errors.items()):
+            self.stderr.write(f"row {number}: {', '.join(row_errors)}")
+        verb = 'valid' if options['dry_run'] else 'created'
+        self.stdout.write(f'{created} shows {verb}, {len(errors)} rows rejected '
+                          f'in {time.perf_counter() - started:.2f}s')
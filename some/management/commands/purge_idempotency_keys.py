@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from some.idempotency import purge_expired
+
+
+class Command(BaseCommand):
+    help = 'Delete idempotency keys whose stored responses have expired'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        deleted = purge_expired(options['batch_size'])
+        self.stdout.write(f'{deleted} expired idempotency keys deleted')
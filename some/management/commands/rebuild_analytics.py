@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from some.analytics import rebuild_analytics
+
+
+class Command(BaseCommand):
+    help = 'Recount the sales rollups used by the analytics API from all orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        rows = rebuild_analytics(options['batch_size'])
+        self.stdout.write(f'{rows} rollup rows rebuilt')
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from some.spending import rebuild_spending
+
+
+class Command(BaseCommand):
+    help = 'Recount money and tickets spent by every user from their orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        users = rebuild_spending(options['batch_size'])
+        self.stdout.write(f'spending of {users} users rebuilt')
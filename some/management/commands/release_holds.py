@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from some.holds import release_expired, sweep_forever
+
+
+class Command(BaseCommand):
+    help = 'Give back seats of expired holds, once or every --interval seconds with --loop'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--loop', action='store_true')
+        parser.add_argument('--interval', type=float, default=5)
+
+    def handle(self, *args, **options):
+        if options['loop']:
+            try:
+                sweep_forever(options['interval'], options['batch_size'], log=self.stdout.write)
+            except KeyboardInterrupt:
+                return
+        released = release_expired(options['batch_size'])
+        self.stdout.write(f'{released} expired holds released')
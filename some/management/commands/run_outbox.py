@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+# handlers register on import
+import some.now_showing  # noqa: F401
+import some.reservations  # noqa: F401
+from some.outbox import run_jobs, work, OUTBOX_BATCH
+
+
+class Command(BaseCommand):
+    help = 'Do the jobs waiting in the outbox, once or as a worker process with --loop'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=OUTBOX_BATCH)
+        parser.add_argument('--loop', action='store_true')
+
+    def handle(self, *args, **options):
+        if options['loop']:
+            try:
+                work(time.sleep, options['batch_size'])
+            except KeyboardInterrupt:
+                return
+        done = 0
+        while True:
+            claimed = run_jobs(options['batch_size'])
+            if not claimed:
+                break
+            done += claimed
+        self.stdout.write(f'{done} outbox jobs processed')
@@ -1,23 +1,57 @@
 import datetime
+import time
+from contextlib import ExitStack
 
+from django.conf import settings
 from django.contrib.auth import logout
-from django.utils import timezone
+from django.db import connections
 from django.utils.deprecation import MiddlewareMixin
 
 from cinema.settings import TIME_TO_LOGOUT
+from some.instrumentation import Sample, current, recorder
+
+# session keeps the start of the last activity bucket, so browsing inside one bucket writes nothing
+ACTIVITY_GRANULARITY = getattr(settings, 'SESSION_ACTIVITY_GRANULARITY', datetime.timedelta(seconds=60))
 
 
 class AutoLogout(MiddlewareMixin):
 
     def process_request(self, request):
         if request.user.is_authenticated and not request.user.is_superuser:
-            form = "%Y %m %d %H:%M:%S"
+            now = int(time.time())
+            granularity = int(ACTIVITY_GRANULARITY.total_seconds()) or 1
             user_time = request.session.get('time')
-            if user_time:
-                user_time = datetime.datetime.strptime(user_time, form)
-                if datetime.datetime.now() - user_time < TIME_TO_LOGOUT:
-                    request.session['time'] = timezone.now().strftime(form)
-                else:
-                    logout(request)
-            else:
-                request.session['time'] = datetime.datetime.now().strftime(form)
+            if not isinstance(user_time, int):
+                # first request or a session from before epoch timestamps
+                request.session['time'] = now - now % granularity
+            elif now - user_time >= TIME_TO_LOGOUT.total_seconds():
+                logout(request)
+            elif now - user_time >= granularity:
+                request.session['time'] = now - now % granularity
+
+
+class Instrumentation:
+    # put it first in MIDDLEWARE: wall time, queries, time in the database and in serializers
+    # of every request go to the recorder under the name of the view
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        sample = Sample(request.method)
+        token = current.set(sample)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(sample))
+                with recorder.profile() as profiler:
+                    response = self.get_response(request)
+        finally:
+            current.reset(token)
+        sample.wall = time.perf_counter() - started
+        match = request.resolver_match
+        sample.view = match.view_name if match else 'unresolved'
+        sample.status = response.status_code
+        recorder.add(sample, profiler)
+        return response
@@ -0,0 +1,23 @@
+# Generated by Django 3.1.7 on 2026-10-18 18:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('some', '0010_auto_20210329_1322'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='place',
+            name='rows',
+            field=models.PositiveSmallIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='show',
+            name='seats',
+            field=models.BinaryField(default=b''),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 3.1.7 on 2026-10-18 18:46
+
+from django.db import migrations, models
+from django.db.models import F, Sum
+import django.db.models.deletion
+
+
+def fill_spending(apps, schema_editor):
+    Order = apps.get_model('some', 'Order')
+    Spending = apps.get_model('some', 'Spending')
+    rows = Order.objects.values('user').annotate(total=Sum(F('amount') * F('show__price')), tickets=Sum('amount'))
+    Spending.objects.bulk_create(Spending(user_id=row['user'], total=row['total'], tickets=row['tickets'])
+                                 for row in rows)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('some', '0012_show_order_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Spending',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='spending', serialize=False, to='some.myuser')),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('tickets', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(fill_spending, migrations.RunPython.noop),
+    ]
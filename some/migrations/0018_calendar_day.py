@@ -0,0 +1,20 @@
+# Generated by Django 3.1.7 on 2026-10-18 19:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('some', '0017_outbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CalendarDay',
+            fields=[
+                ('date', models.DateField(primary_key=True, serialize=False)),
+                ('data', models.JSONField(default=list)),
+            ],
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 3.1.7 on 2026-10-18 19:18
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('some', '0018_calendar_day'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='place',
+            name='rows',
+            field=models.PositiveSmallIntegerField(default=1, validators=[django.core.validators.MinValueValidator(1)]),
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.contrib.auth.models import AbstractUser
+from django.core.validators import MinValueValidator
 from django.db import models
 import datetime as dt
 from django.utils import timezone
@@ -15,6 +16,12 @@ class MyUser(AbstractUser):
 class Place(models.Model):
     name = models.CharField(max_length=40, unique=True)
     size = models.PositiveSmallIntegerField(default=1)
+    rows = models.PositiveSmallIntegerField(default=1, validators=[MinValueValidator(1)])
+
+    @property
+    def row_size(self):
+        # seats in one row, the last row may be shorter
+        return -(-self.size // self.rows)
 
     def __str__(self):
         return self.name
@@ -36,6 +43,18 @@ class Show(models.Model):
     show_time_end = models.DateTimeField(default=now)
     busy = models.PositiveSmallIntegerField(default=0)
     price = models.PositiveSmallIntegerField()
+    # bitmap of taken seats, bit i is the i-th seat of the place counting row by row
+    seats = models.BinaryField(default=b'', editable=False)
+
+    class Meta:
+        indexes = [
+            # schedule of a place and overlap checks
+            models.Index(fields=['place', 'show_time_start'], name='show_place_start_idx'),
+            models.Index(fields=['place', 'show_time_end'], name='show_place_end_idx'),
+            # day listings sorted by date or by price
+            models.Index(fields=['show_time_start', 'price'], name='show_start_price_idx'),
+            models.Index(fields=['price', 'id'], name='show_price_idx'),
+        ]
 
     def __str__(self):
         return f'{self.film} on {self.show_time_start}'
@@ -46,7 +65,84 @@ class Order(models.Model):
     show = models.ForeignKey('Show', on_delete=models.DO_NOTHING)
     amount = models.PositiveSmallIntegerField(default=1)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'id'], name='order_user_idx'),
+        ]
+
     def __str__(self):
         return f'{self.amount} pieces on {self.show.film.name}'
 
 
+class Spending(models.Model):
+    # money and tickets spent by the user, kept in step with Order so totals are one row away
+    user = models.OneToOneField('MyUser', on_delete=models.CASCADE, primary_key=True, related_name='spending')
+    total = models.PositiveIntegerField(default=0)
+    tickets = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f'{self.user} spent {self.total} on {self.tickets} tickets'
+
+
+class SalesRollup(models.Model):
+    # tickets and revenue per show hour, analytics sum these instead of orders
+    date = models.DateField()
+    hour = models.PositiveSmallIntegerField()
+    film = models.ForeignKey('Film', on_delete=models.CASCADE, related_name='+')
+    place = models.ForeignKey('Place', on_delete=models.CASCADE, related_name='+')
+    tickets = models.PositiveIntegerField(default=0)
+    revenue = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('date', 'hour', 'film', 'place')
+
+    def __str__(self):
+        return f'{self.film} in {self.place} on {self.date} {self.hour}h'
+
+
+class IdempotencyKey(models.Model):
+    # response stored under a client-supplied key, so a retried request is answered without doing it again
+    user = models.ForeignKey('MyUser', on_delete=models.CASCADE, related_name='+')
+    key = models.CharField(max_length=64)
+    path = models.CharField(max_length=200)
+    status = models.PositiveSmallIntegerField(null=True)
+    body = models.TextField(blank=True)
+    expires = models.DateTimeField(db_index=True)
+
+    class Meta:
+        unique_together = ('user', 'key')
+
+    def __str__(self):
+        return f'{self.key} of {self.user}'
+
+
+class SeatHold(models.Model):
+    # seats counted in Show.busy for a user who is paying, released by the sweeper once expired
+    show = models.ForeignKey('Show', on_delete=models.CASCADE, related_name='holds')
+    user = models.ForeignKey('MyUser', on_delete=models.CASCADE, related_name='holds')
+    amount = models.PositiveIntegerField()
+    expires = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f'{self.amount} seats of {self.show} held by {self.user}'
+
+
+class OutboxJob(models.Model):
+    # work left after a commit, done by the outbox worker; available_at is empty once retries are exhausted
+    kind = models.CharField(max_length=40)
+    payload = models.JSONField()
+    attempts = models.PositiveSmallIntegerField(default=0)
+    available_at = models.DateTimeField(null=True, default=now, db_index=True)
+    error = models.TextField(blank=True)
+
+    def __str__(self):
+        return f'{self.kind} {self.payload}'
+
+
+class CalendarDay(models.Model):
+    # films playing on the date with their shows and free seats, kept up to date by some.now_showing
+    date = models.DateField(primary_key=True)
+    data = models.JSONField(default=list)
+
+    def __str__(self):
+        return str(self.date)
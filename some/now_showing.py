@@ -0,0 +1,160 @@
+import datetime
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from some.models import Show, Film, Place, CalendarDay
+from some.outbox import handler, enqueue
+
+# how many days the calendar shows by default
+CALENDAR_DAYS = getattr(settings, 'CALENDAR_DAYS', 30)
+# the most days one read builds, and the days from today that writes of shows materialize
+CALENDAR_MAX_DAYS = getattr(settings, 'CALENDAR_MAX_DAYS', 60)
+
+SHOW_FIELDS = ('id', 'show_time_start', 'show_time_end', 'price', 'busy', 'film_id', 'film__name',
+               'place_id', 'place__name', 'place__size')
+
+
+def show_date(start):
+    return timezone.localtime(start).date()
+
+
+def day_bounds(date):
+    start = timezone.make_aware(datetime.datetime.combine(date, datetime.time.min))
+    return start, timezone.make_aware(datetime.datetime.combine(date + datetime.timedelta(days=1),
+                                                                datetime.time.min))
+
+
+def build_day(date):
+    # films of the date sorted by name, each with its shows sorted by start, from one query
+    films = {}
+    start, end = day_bounds(date)
+    for row in Show.objects.filter(show_time_start__gte=start, show_time_start__lt=end) \
+            .order_by('film__name', 'film_id', 'show_time_start', 'id').values(*SHOW_FIELDS):
+        film = films.get(row['film_id'])
+        if film is None:
+            film = films[row['film_id']] = {'id': row['film_id'], 'name': row['film__name'], 'shows': []}
+        film['shows'].append({'id': row['id'], 'start': row['show_time_start'].isoformat(),
+                              'end': row['show_time_end'].isoformat(), 'price': row['price'],
+                              'place': row['place_id'], 'place_name': row['place__name'],
+                              'free': row['place__size'] - row['busy']})
+    return list(films.values())
+
+
+def dates_from(first, count):
+    return [first + datetime.timedelta(days=i) for i in range(count)]
+
+
+def rebuild(dates):
+    # recompute the materialized days and materialize those of the next CALENDAR_MAX_DAYS days
+    dates = set(dates)
+    existing = set(CalendarDay.objects.filter(date__in=dates).values_list('date', flat=True))
+    for date in existing:
+        CalendarDay.objects.filter(date=date).update(data=build_day(date))
+    window = set(dates_from(timezone.localdate(), CALENDAR_MAX_DAYS))
+    save_days((dates & window) - existing)
+
+
+def materialize(first=None, count=CALENDAR_DAYS):
+    # save the days from `first` that are not materialized yet, returns how many were saved
+    dates = set(dates_from(first or timezone.localdate(), count))
+    missing = dates - set(CalendarDay.objects.filter(date__in=dates).values_list('date', flat=True))
+    save_days(missing)
+    return len(missing)
+
+
+def save_days(dates):
+    CalendarDay.objects.bulk_create((CalendarDay(date=date, data=build_day(date)) for date in dates),
+                                    ignore_conflicts=True)
+
+
+def forget(dates=None):
+    # drop days whose shows were written without signals, e.g. by bulk_create
+    days = CalendarDay.objects.all()
+    if dates is not None:
+        days = days.filter(date__in=set(dates))
+    days.delete()
+
+
+def calendar(first=None, count=CALENDAR_DAYS):
+    # [(date, films)] of `count` days from `first`, at most CALENDAR_MAX_DAYS, one indexed read when they
+    # are all materialized; missing days are built but not saved, reads never write
+    first = first or timezone.localdate()
+    dates = dates_from(first, min(count, CALENDAR_MAX_DAYS))
+    days = dict(CalendarDay.objects.filter(date__range=(dates[0], dates[-1])).values_list('date', 'data'))
+    return [(date, days[date] if date in days else build_day(date)) for date in dates]
+
+
+def upcoming(films, now=None):
+    # films of a day without the shows that have already started
+    now = (now or timezone.now()).isoformat()
+    result = []
+    for film in films:
+        shows = [show for show in film['shows'] if show['start'] > now]
+        if shows:
+            result.append(dict(film, shows=shows))
+    return result
+
+
+@handler('seats')
+def patch_seats(payloads):
+    # free seats of shows whose busy changed, each materialized day is rewritten once
+    by_date = defaultdict(dict)
+    for show_id, start, busy, size in Show.objects.filter(id__in={payload['show'] for payload in payloads}) \
+            .values_list('id', 'show_time_start', 'busy', 'place__size'):
+        by_date[show_date(start)][show_id] = size - busy
+    for date, free in by_date.items():
+        with transaction.atomic():
+            day = CalendarDay.objects.select_for_update().filter(date=date).first()
+            if day is None:
+                continue
+            for film in day.data:
+                for show in film['shows']:
+                    if show['id'] in free:
+                        show['free'] = free[show['id']]
+            day.save(update_fields=('data', ))
+
+
+@handler('days')
+def rebuild_days(payloads):
+    # days touched by a burst of writes, e.g. the shows of a deleted film, are rebuilt once
+    rebuild({datetime.date.fromisoformat(date) for payload in payloads for date in payload['dates']})
+
+
+def rebuild_later(dates):
+    # from the signals, after the commit and outside of the request
+    dates = sorted({date.isoformat() for date in dates})
+    if dates:
+        enqueue('days', {'dates': dates})
+
+
+@receiver(pre_save, sender=Show)
+def remember_show_date(sender, instance, **kwargs):
+    # the show may move to another day
+    if instance.pk is not None:
+        instance._calendar_dates = [show_date(start) for start in Show.objects.filter(id=instance.pk)
+                                    .values_list('show_time_start', flat=True)]
+
+
+@receiver(post_save, sender=Show)
+def update_show_days(sender, instance, **kwargs):
+    rebuild_later(getattr(instance, '_calendar_dates', []) + [show_date(instance.show_time_start)])
+
+
+@receiver(post_delete, sender=Show)
+def update_deleted_show_day(sender, instance, **kwargs):
+    rebuild_later([show_date(instance.show_time_start)])
+
+
+@receiver(post_save, sender=Film)
+@receiver(post_save, sender=Place)
+def update_named_days(sender, instance, **kwargs):
+    # names and sizes are copied into the days of their shows
+    field = 'film' if sender is Film else 'place'
+    days = Show.objects.filter(**{field: instance}, show_time_start__gte=day_bounds(timezone.localdate())[0]) \
+        .datetimes('show_time_start', 'day')
+    rebuild_later(day.date() for day in days)
@@ -0,0 +1,144 @@
+import datetime
+import logging
+import queue
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction, close_old_connections, OperationalError
+from django.db.models import F
+from django.utils import timezone
+
+from some.models import OutboxJob
+
+logger = logging.getLogger(__name__)
+
+# jobs handed to the handlers at once
+OUTBOX_BATCH = getattr(settings, 'OUTBOX_BATCH', 100)
+OUTBOX_MAX_ATTEMPTS = getattr(settings, 'OUTBOX_MAX_ATTEMPTS', 5)
+# first retry delay, doubled with every attempt
+OUTBOX_RETRY_DELAY = getattr(settings, 'OUTBOX_RETRY_DELAY', datetime.timedelta(seconds=5))
+# claimed jobs of a worker that died are picked up again after this
+OUTBOX_LEASE = getattr(settings, 'OUTBOX_LEASE', datetime.timedelta(minutes=1))
+# how often an idle worker looks for retries that became due
+OUTBOX_INTERVAL = getattr(settings, 'OUTBOX_INTERVAL', 5)
+
+handlers = {}
+
+
+def handler(kind):
+    # register func(payloads) doing the jobs of a kind, it gets a list of payloads and runs in a transaction
+    def register(func):
+        handlers[kind] = func
+        return func
+    return register
+
+
+def enqueue(kind, payload):
+    # call it in the transaction that did the work, the job is committed or rolled back with it
+    OutboxJob.objects.create(kind=kind, payload=payload)
+    transaction.on_commit(worker.wake)
+
+
+def enqueue_many(kind, payloads):
+    OutboxJob.objects.bulk_create(OutboxJob(kind=kind, payload=payload) for payload in payloads)
+    transaction.on_commit(worker.wake)
+
+
+def claim(batch_size):
+    # lease due jobs so that other workers skip them
+    now = timezone.now()
+    with transaction.atomic():
+        jobs = list(OutboxJob.objects.filter(available_at__lte=now).order_by('available_at', 'id')
+                    .select_for_update(skip_locked=True)[:batch_size])
+        OutboxJob.objects.filter(id__in=[job.id for job in jobs]) \
+            .update(available_at=now + OUTBOX_LEASE, attempts=F('attempts') + 1)
+    return jobs
+
+
+def perform(kind, jobs):
+    with transaction.atomic():
+        handlers[kind]([job.payload for job in jobs])
+        OutboxJob.objects.filter(id__in=[job.id for job in jobs]).delete()
+
+
+def retry(job, error):
+    # claim has already counted this attempt
+    attempts = job.attempts + 1
+    if attempts >= OUTBOX_MAX_ATTEMPTS:
+        logger.error('outbox job %s failed %s times, giving up: %r', job.id, attempts, error)
+        available_at = None
+    else:
+        available_at = timezone.now() + OUTBOX_RETRY_DELAY * 2 ** (attempts - 1)
+    OutboxJob.objects.filter(id=job.id).update(available_at=available_at, error=repr(error))
+
+
+def run_jobs(batch_size=OUTBOX_BATCH):
+    # do one batch of due jobs, returns the number of jobs claimed
+    jobs = claim(batch_size)
+    by_kind = defaultdict(list)
+    for job in jobs:
+        by_kind[job.kind].append(job)
+    for kind, kind_jobs in by_kind.items():
+        try:
+            perform(kind, kind_jobs)
+            continue
+        except Exception as e:
+            if len(kind_jobs) == 1:
+                retry(kind_jobs[0], e)
+                continue
+        # one by one, so that a bad job doesn't hold back the rest of the batch
+        for job in kind_jobs:
+            try:
+                perform(kind, [job])
+            except Exception as e:
+                retry(job, e)
+    return len(jobs)
+
+
+def work(wait, batch_size=OUTBOX_BATCH):
+    # the worker loop: wait(timeout) returns when there may be new jobs or the timeout passes
+    while True:
+        # a long lived loop outside of requests has to drop broken and expired connections itself
+        close_old_connections()
+        try:
+            while run_jobs(batch_size):
+                pass
+        except OperationalError as e:
+            # on SQLite the worker and the requests take turns at one write lock, a locked database
+            # is tried again on the next pass; run manage.py run_outbox instead of the thread there
+            logger.warning('outbox worker will retry: %s', e)
+        except Exception:
+            logger.exception('outbox worker failed')
+        wait(OUTBOX_INTERVAL)
+
+
+class Worker:
+    # thread of this process started by the first commit with a job and woken by the following ones,
+    # set OUTBOX_WORKER to None to leave the jobs to manage.py run_outbox
+
+    def __init__(self):
+        self.wakes = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def wake(self):
+        if getattr(settings, 'OUTBOX_WORKER', 'thread') != 'thread':
+            return
+        self.wakes.put(None)
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=work, args=(self.wait, ), name='outbox', daemon=True)
+                self.thread.start()
+
+    def wait(self, timeout):
+        try:
+            self.wakes.get(timeout=timeout)
+        except queue.Empty:
+            return
+        # a burst of commits needs one pass
+        while not self.wakes.empty():
+            self.wakes.get_nowait()
+
+
+worker = Worker()
@@ -0,0 +1,193 @@
+import datetime
+import threading
+import time
+from bisect import bisect_left, insort
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from some import schedule_cache
+from some.models import Show, Place
+
+# places are reloaded after this many seconds, without a shared cache nothing else tells
+# about shows written by other processes
+OVERLAP_INDEX_TTL = getattr(settings, 'OVERLAP_INDEX_TTL', 60)
+
+
+def version_key(place_id):
+    # counter of changes to the shows of a place in the shared cache
+    return f'overlap:place:{place_id}'
+
+
+class PlaceIntervals:
+    # shows of one place sorted by start; older data may have overlapping shows, so every show
+    # starting less than the longest show's length before a new one is looked at
+
+    def __init__(self, rows=()):
+        self.items = sorted(rows)
+        self.longest = max((end - start for start, end, _ in self.items), default=datetime.timedelta(0))
+
+    def copy(self):
+        intervals = PlaceIntervals()
+        intervals.items = list(self.items)
+        intervals.longest = self.longest
+        return intervals
+
+    def conflict(self, start, end, exclude=None):
+        # id of a show intersecting [start, end) or None
+        i = bisect_left(self.items, (end, )) - 1
+        while i >= 0:
+            show_start, show_end, show_id = self.items[i]
+            if show_start + self.longest <= start:
+                break
+            if show_id != exclude and show_end > start:
+                return show_id
+            i -= 1
+        return None
+
+    def add(self, start, end, show_id):
+        insort(self.items, (start, end, show_id))
+        self.longest = max(self.longest, end - start)
+
+    def remove(self, show_id):
+        self.items = [item for item in self.items if item[2] != show_id]
+
+
+def intersecting(place_id, start, end):
+    return Show.objects.filter(place_id=place_id, show_time_start__lt=end, show_time_end__gt=start) \
+        .values_list('show_time_start', 'show_time_end', 'id')
+
+
+def stored(place_id, start, end):
+    # shows of the place intersecting [start, end) read from the database with the place row locked,
+    # so that concurrent writers of its schedule take turns; call it in the transaction writing shows
+    list(Place.objects.select_for_update().filter(id=place_id).values_list('id'))
+    return PlaceIntervals(intersecting(place_id, start, end))
+
+
+def overlapping(place_id, start, end, exclude=None):
+    # id of a stored show intersecting [start, end) or None, the check made while writing
+    return stored(place_id, start, end).conflict(start, end, exclude)
+
+
+class OverlapIndex:
+    # per-place interval indexes, loaded on first use and kept up to date by signals; a place is reloaded
+    # when its version in the shared cache shows a change made by another process, or after OVERLAP_INDEX_TTL.
+    # They may still miss shows being written, so they answer forms quickly and writes check again with overlapping()
+
+    def __init__(self):
+        self.places = {}
+        self.versions = {}
+        self.loaded = 0
+        self.lock = threading.Lock()
+
+    def place(self, place_id):
+        version = schedule_cache.counter(version_key(place_id))
+        with self.lock:
+            if time.monotonic() - self.loaded > OVERLAP_INDEX_TTL:
+                self.places.clear()
+                self.versions.clear()
+                self.loaded = time.monotonic()
+            intervals = self.places.get(place_id)
+            if self.versions.get(place_id) != version:
+                intervals = None
+        if intervals is None:
+            intervals = PlaceIntervals(Show.objects.filter(place_id=place_id)
+                                       .values_list('show_time_start', 'show_time_end', 'id'))
+            with self.lock:
+                self.places[place_id] = intervals
+                self.versions[place_id] = version
+        return intervals
+
+    def conflict(self, place_id, start, end, exclude=None):
+        intervals = self.place(place_id)
+        with self.lock:
+            return intervals.conflict(start, end, exclude)
+
+    def conflicts(self, shows, locked=False):
+        # check a batch of (place_id, start, end) against the schedule and each other,
+        # returns {position in the batch: id of the show it overlaps or None if it overlaps the batch};
+        # with locked the schedules are read by stored(), in the transaction writing the batch
+        pending = {}
+        errors = {}
+        if locked:
+            bounds = {}
+            for place_id, start, end in shows:
+                first, last = bounds.get(place_id, (start, end))
+                bounds[place_id] = (min(first, start), max(last, end))
+            for place_id in sorted(bounds):
+                pending[place_id] = stored(place_id, *bounds[place_id])
+        for position, (place_id, start, end) in enumerate(shows):
+            if place_id not in pending:
+                intervals = self.place(place_id)
+                with self.lock:
+                    pending[place_id] = intervals.copy()
+            intervals = pending[place_id]
+            show_id = intervals.conflict(start, end)
+            if show_id is not None:
+                errors[position] = show_id if show_id >= 0 else None
+            else:
+                # negative ids mark shows of the batch itself
+                intervals.add(start, end, -position - 1)
+        return errors
+
+    def update(self, show, place_ids=()):
+        # the show was saved, place_ids are the places it was in before
+        with self.lock:
+            for intervals in self.places.values():
+                intervals.remove(show.id)
+            if show.place_id in self.places:
+                self.places[show.place_id].add(show.show_time_start, show.show_time_end, show.id)
+        for place_id in {show.place_id, *place_ids}:
+            transaction.on_commit(lambda place_id=place_id: self.changed(place_id))
+
+    def discard(self, show_id, place_id):
+        with self.lock:
+            for intervals in self.places.values():
+                intervals.remove(show_id)
+        transaction.on_commit(lambda: self.changed(place_id))
+
+    def changed(self, place_id):
+        # tell the other processes, this one is up to date unless the place was changed elsewhere meanwhile
+        version = schedule_cache.bump(version_key(place_id))
+        with self.lock:
+            if version is None or place_id not in self.versions:
+                return
+            if self.versions[place_id] == version - 1:
+                self.versions[place_id] = version
+            else:
+                del self.places[place_id], self.versions[place_id]
+
+    def reset(self, place_ids=None):
+        # forget places whose shows were written without signals, e.g. by bulk_create, in every process
+        with self.lock:
+            if place_ids is None:
+                self.places.clear()
+                self.versions.clear()
+            for place_id in place_ids or ():
+                self.places.pop(place_id, None)
+                self.versions.pop(place_id, None)
+        for place_id in place_ids or ():
+            schedule_cache.bump(version_key(place_id))
+
+
+overlap_index = OverlapIndex()
+
+
+@receiver(pre_save, sender=Show)
+def remember_show_place(sender, instance, **kwargs):
+    # the show may move to another place
+    if instance.pk is not None:
+        instance._overlap_places = list(Show.objects.filter(id=instance.pk).values_list('place_id', flat=True))
+
+
+@receiver(post_save, sender=Show)
+def update_overlap_index(sender, instance, **kwargs):
+    overlap_index.update(instance, getattr(instance, '_overlap_places', ()))
+
+
+@receiver(post_delete, sender=Show)
+def discard_from_overlap_index(sender, instance, **kwargs):
+    overlap_index.discard(instance.id, instance.place_id)
@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.core.mail import get_connection, EmailMessage
+from django.utils import timezone
+
+from some.models import Order
+
+
+def receipt(order):
+    show = order.show
+    start = timezone.localtime(show.show_time_start).strftime('%d.%m.%Y %H:%M')
+    body = (f'{order.amount} tickets for {show.film.name} in {show.place.name} on {start}, '
+            f'{order.amount * show.price} paid.\n')
+    return EmailMessage(f'Your tickets for {show.film.name}', body, settings.DEFAULT_FROM_EMAIL, [order.user.email])
+
+
+def send_receipts(order_ids):
+    # mail receipts of the orders to users with an email address over one connection, returns how many were sent
+    orders = Order.objects.filter(id__in=order_ids).exclude(user__email='') \
+        .select_related('user', 'show__film', 'show__place')
+    messages = [receipt(order) for order in orders]
+    if not messages:
+        return 0
+    return get_connection().send_messages(messages)
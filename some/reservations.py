@@ -0,0 +1,94 @@
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery
+from django.utils import timezone
+
+from some.models import Show, Order, Place
+from some import schedule_cache
+from some.analytics import record_sales
+from some.events import broker
+from some.outbox import enqueue, enqueue_many, handler
+from some.receipts import send_receipts
+from some.spending import add_spending, add_spent
+
+
+class CartError(Exception):
+
+    def __init__(self, show_id, message):
+        super().__init__(message)
+        self.show_id = show_id
+
+
+def seats_changed(show_id):
+    # busy of the show moved, tell caches and subscribers once the transaction commits,
+    # free seats of the calendar are updated by the outbox worker
+    transaction.on_commit(schedule_cache.count_sale)
+    transaction.on_commit(lambda: broker.publish(show_id))
+    enqueue('seats', {'show': show_id})
+
+
+def sell(show_id, user_id, amount):
+    # create the order for seats already counted in busy with its spending,
+    # the rest is done by the outbox worker after the commit
+    add_spending(user_id, show_id, amount)
+    order = Order.objects.create(show_id=show_id, user_id=user_id, amount=amount)
+    enqueue('order', {'order': order.id, 'show': show_id, 'amount': amount})
+    return order
+
+
+@handler('order')
+def after_purchase(payloads):
+    # rollups of all orders of the batch together, then their receipts
+    amounts = Counter()
+    for payload in payloads:
+        amounts[payload['show']] += payload['amount']
+    record_sales(amounts)
+    send_receipts([payload['order'] for payload in payloads])
+
+
+def take_seats(show_id, amount):
+    # add `amount` to busy if the hall has room, returns whether it did; the size is read by a subquery
+    # on the updated row, a join would turn the UPDATE into `id IN (SELECT ...)` whose check isn't
+    # repeated after waiting for a concurrent buyer's lock
+    size = Subquery(Place.objects.filter(id=OuterRef('place_id')).values('size')[:1])
+    return bool(Show.objects.filter(id=show_id, busy__lte=size - amount).update(busy=F('busy') + amount))
+
+
+def reserve_seats(show_id, user_id, amount):
+    # take `amount` seats of the show with one conditional UPDATE and create the order
+    # in the same transaction, returns created Order or None if the hall is full
+    with transaction.atomic():
+        if not take_seats(show_id, amount):
+            return None
+        seats_changed(show_id)
+        return sell(show_id, user_id, amount)
+
+
+def reserve_cart(user_id, items):
+    # buy (show id, amount) pairs all or nothing, returns created orders or raises CartError;
+    # shows are taken in the order of their ids, so concurrent carts lock rows in the same order
+    amounts = Counter()
+    for show_id, amount in items:
+        amounts[show_id] += amount
+    prices = dict(Show.objects.filter(id__in=amounts, show_time_end__gt=timezone.now()).values_list('id', 'price'))
+    with transaction.atomic():
+        for show_id in sorted(amounts):
+            if show_id not in prices:
+                raise CartError(show_id, 'no such show or it is over')
+            if not take_seats(show_id, amounts[show_id]):
+                raise CartError(show_id, 'not enough places in hall')
+            seats_changed(show_id)
+        add_spent(user_id, sum(prices[show_id] * amount for show_id, amount in amounts.items()),
+                  sum(amounts.values()))
+        orders = Order.objects.bulk_create(Order(show_id=show_id, user_id=user_id, amount=amount)
+                                           for show_id, amount in sorted(amounts.items()))
+        if orders[0].pk is None:
+            # the backend doesn't return ids of inserted rows, ours are the newest orders of the user for these shows
+            ids = dict(Order.objects.filter(user_id=user_id, show_id__in=amounts).order_by('-id')
+                       .values_list('show_id', 'id')[:len(orders)])
+            for order in orders:
+                order.pk = ids[order.show_id]
+        enqueue_many('order', ({'order': order.pk, 'show': order.show_id, 'amount': order.amount}
+                               for order in orders))
+        return orders
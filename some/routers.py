@@ -0,0 +1,99 @@
+import datetime
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+# add 'some.routers.ReplicaRouter' to DATABASE_ROUTERS and a REPLICA_DATABASE alias to DATABASES to use it,
+# the router tests run when the alias is configured
+REPLICA_DATABASE = getattr(settings, 'REPLICA_DATABASE', 'replica')
+# how long after a purchase the user keeps reading from the primary
+REPLICA_LAG = getattr(settings, 'REPLICA_LAG', datetime.timedelta(seconds=5))
+# cache holding the pins, it must be shared by all processes or the others keep reading from the replica
+REPLICA_PIN_CACHE = getattr(settings, 'REPLICA_PIN_CACHE', 'default')
+
+use_replica = ContextVar('use_replica', default=False)
+
+
+@contextmanager
+def read_from_replica():
+    token = use_replica.set(True)
+    try:
+        yield
+    finally:
+        use_replica.reset(token)
+
+
+def pin_key(user_id):
+    return f'primary:{user_id}'
+
+
+def pin_to_primary(user_id):
+    # the user has just written, replica may not have it yet
+    caches[REPLICA_PIN_CACHE].set(pin_key(user_id), True, REPLICA_LAG.total_seconds())
+
+
+def is_pinned(user_id):
+    return user_id is not None and caches[REPLICA_PIN_CACHE].get(pin_key(user_id), False)
+
+
+def pins_shared():
+    backend = settings.CACHES.get(REPLICA_PIN_CACHE, {}).get('BACKEND', '')
+    return bool(backend) and not backend.endswith(('LocMemCache', 'DummyCache'))
+
+
+class ReplicaRouter:
+    # reads of views that opted in go to the replica, everything else to the primary
+
+    def __init__(self):
+        if not pins_shared():
+            logger.warning('REPLICA_PIN_CACHE %r is not shared between processes, users may not see '
+                           'their purchases when another process serves them', REPLICA_PIN_CACHE)
+
+    def db_for_read(self, model, **hints):
+        if use_replica.get() and REPLICA_DATABASE in settings.DATABASES:
+            return REPLICA_DATABASE
+        return None
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # both databases hold the same rows
+        return True
+
+
+class ReplicaReadMixin:
+    # opt-in for Django views: safe requests of users who haven't just bought something read from the replica
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD') or is_pinned(request.user.id):
+            return super().dispatch(request, *args, **kwargs)
+        with read_from_replica():
+            response = super().dispatch(request, *args, **kwargs)
+            if hasattr(response, 'render'):
+                response.render()
+            return response
+
+
+class ReplicaAPIMixin:
+    # the same for DRF views, decided after authentication; viewsets may limit it to some actions
+    replica_actions = None
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        action = getattr(self, 'action', None)
+        if request.method in ('GET', 'HEAD') and not is_pinned(request.user.id) and \
+                (self.replica_actions is None or action in self.replica_actions):
+            self.replica_token = use_replica.set(True)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        token = getattr(self, 'replica_token', None)
+        if token is not None:
+            use_replica.reset(token)
+            self.replica_token = None
+        return super().finalize_response(request, response, *args, **kwargs)
@@ -0,0 +1,133 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from some.models import Show, Film, Place
+
+# shows start and tickets get sold without any signal, so cached pages still expire
+TIMEOUT = getattr(settings, 'SCHEDULE_CACHE_TIMEOUT', 60)
+LOCAL_SIZE = getattr(settings, 'SCHEDULE_CACHE_SIZE', 256)
+GENERATION_KEY = 'schedule:generation'
+SALES_KEY = 'schedule:sales'
+
+
+class LRUCache:
+    # bounded in-process cache used when no shared cache is configured
+
+    def __init__(self, size):
+        self.size = size
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            item = self.data.get(key)
+            if item is None:
+                return default
+            value, expires = item
+            if expires < time.monotonic():
+                del self.data[key]
+                return default
+            self.data.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout=TIMEOUT):
+        with self.lock:
+            self.data[key] = (value, time.monotonic() + timeout)
+            self.data.move_to_end(key)
+            while len(self.data) > self.size:
+                self.data.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+
+local_cache = LRUCache(LOCAL_SIZE)
+
+
+def shared_cache():
+    # configured cache if it is shared between processes, None otherwise
+    alias = getattr(settings, 'SCHEDULE_CACHE', 'default')
+    backend = settings.CACHES.get(alias, {}).get('BACKEND', '')
+    if not backend or backend.endswith(('LocMemCache', 'DummyCache')):
+        return None
+    return caches[alias]
+
+
+def generation():
+    # changes whenever a show, film or place is saved or deleted in any process
+    cache = shared_cache()
+    return cache.get(GENERATION_KEY, 0) if cache else 0
+
+
+def make_key(*parts):
+    # keyed on the ETag version, so a tag made after a sale never comes with a page cached before it
+    return ':'.join(['schedule', version() or '0'] + [str(part) for part in parts])
+
+
+def get(key):
+    cache = shared_cache()
+    return (cache or local_cache).get(key)
+
+
+def set(key, value):
+    cache = shared_cache()
+    (cache or local_cache).set(key, value, TIMEOUT)
+
+
+def counter(key):
+    # value of a counter kept in the shared cache, None without one
+    cache = shared_cache()
+    return cache.get(key, 0) if cache else None
+
+
+def bump(key):
+    # returns the new value of the counter, None without a shared cache
+    cache = shared_cache()
+    if cache is None:
+        return None
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)
+        return 1
+
+
+def invalidate():
+    # old keys are left to expire, new ones get the next generation
+    bump(GENERATION_KEY)
+    if shared_cache() is None:
+        local_cache.clear()
+
+
+def count_sale():
+    # tickets were sold, busy in the listings changed
+    bump(SALES_KEY)
+
+
+def version(sales=True):
+    # ETag of the listings, None without a shared cache: counters of one process don't see writes of the others.
+    # It changes with every saved or deleted show, film or place and, unless sales is False, with every sale
+    # and every TIMEOUT seconds, as shows that have started leave the schedule without any signal
+    cache = shared_cache()
+    if cache is None:
+        return None
+    counters = cache.get_many([GENERATION_KEY, SALES_KEY])
+    catalog, sold = counters.get(GENERATION_KEY, 0), counters.get(SALES_KEY, 0)
+    return f'{catalog}-{sold}-{int(time.time() // TIMEOUT)}' if sales else f'{catalog}'
+
+
+@receiver(post_save, sender=Show)
+@receiver(post_save, sender=Film)
+@receiver(post_save, sender=Place)
+@receiver(post_delete, sender=Show)
+@receiver(post_delete, sender=Film)
+@receiver(post_delete, sender=Place)
+def invalidate_schedule(sender, **kwargs):
+    invalidate()
@@ -0,0 +1,134 @@
+import csv
+import datetime
+import json
+
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from some import schedule_cache, now_showing
+from some.models import Place, Film, Show
+from some.overlap import overlap_index
+
+FIELDS = ('place', 'film', 'show_time_start', 'show_time_end', 'price')
+BATCH_SIZE = 1000
+
+
+def read_csv(lines):
+    # lines of text with a header row naming FIELDS
+    return csv.DictReader(lines)
+
+
+def read_json(lines):
+    # either one JSON array or one JSON object per line
+    lines = iter(lines)
+    for line in lines:
+        if not line.strip():
+            continue
+        if line.lstrip().startswith('['):
+            yield from json.loads(line + ''.join(lines))
+            return
+        yield json.loads(line)
+
+
+class ScheduleImport:
+    # validate rows of a schedule in memory and create the good ones with bulk_create
+
+    def __init__(self, batch_size=BATCH_SIZE):
+        self.batch_size = batch_size
+        self.places = self.lookup(Place.objects.all())
+        self.films = self.lookup(Film.objects.all())
+        self.now = timezone.now()
+        self.timezone = timezone.get_current_timezone()
+
+    @staticmethod
+    def lookup(queryset):
+        # objects by id and by name, rows may use either
+        objects = {}
+        for obj in queryset:
+            objects[str(obj.id)] = objects[obj.name] = obj
+        return objects
+
+    def parse_time(self, value):
+        if isinstance(value, datetime.datetime):
+            time = value
+        else:
+            value = str(value or '').strip()
+            try:
+                # much faster than parse_datetime for the ISO strings most exports have
+                time = datetime.datetime.fromisoformat(value)
+            except ValueError:
+                time = parse_datetime(value)
+        if time is not None and time.tzinfo is None:
+            time = timezone.make_aware(time, self.timezone)
+        return time
+
+    def clean(self, row):
+        # Show built from the row and list of errors
+        if not isinstance(row, dict):
+            return None, ['row must be an object']
+        errors = []
+        place = self.places.get(str(row.get('place', '')).strip())
+        film = self.films.get(str(row.get('film', '')).strip())
+        try:
+            start = self.parse_time(row.get('show_time_start'))
+            end = self.parse_time(row.get('show_time_end'))
+        except ValueError:
+            start = end = None
+        try:
+            price = int(row.get('price'))
+        except (TypeError, ValueError):
+            price = -1
+
+        if place is None:
+            errors.append('unknown place')
+        if film is None:
+            errors.append('unknown film')
+        if price < 0:
+            errors.append('price must be a positive number')
+        if start is None or end is None:
+            errors.append('wrong show time')
+        else:
+            if start < self.now:
+                errors.append('show cant be held in past')
+            if start >= end:
+                errors.append('finish must occur after start')
+            if film and not (film.begin <= start.date() <= film.end and film.begin <= end.date() <= film.end):
+                errors.append('show must be held during film period')
+        if errors:
+            return None, errors
+        return Show(place_id=place.id, film_id=film.id, show_time_start=start, show_time_end=end, price=price), errors
+
+    def drop_overlapping(self, shows, numbers, errors, locked=False):
+        # shows and their row numbers without the overlapping ones, which get errors instead
+        conflicts = overlap_index.conflicts([(show.place_id, show.show_time_start, show.show_time_end)
+                                             for show in shows], locked=locked)
+        for position, show_id in conflicts.items():
+            errors[numbers[position]] = [f'overlaps show {show_id}' if show_id
+                                         else 'overlaps another show of the import']
+        kept = [position for position in range(len(shows)) if position not in conflicts]
+        return [shows[position] for position in kept], [numbers[position] for position in kept]
+
+    def run(self, rows, dry_run=False):
+        # returns count of created shows and {row number: errors}, rows are counted from 1
+        shows, numbers, errors = [], [], {}
+        for number, row in enumerate(rows, start=1):
+            show, row_errors = self.clean(row)
+            if row_errors:
+                errors[number] = row_errors
+            else:
+                shows.append(show)
+                numbers.append(number)
+
+        shows, numbers = self.drop_overlapping(shows, numbers, errors)
+        if shows and not dry_run:
+            with transaction.atomic():
+                # the index may miss shows written by other processes, look again with the places locked
+                shows, numbers = self.drop_overlapping(shows, numbers, errors, locked=True)
+                for i in range(0, len(shows), self.batch_size):
+                    Show.objects.bulk_create(shows[i:i + self.batch_size])
+            # bulk_create sends no signals
+            overlap_index.reset({show.place_id for show in shows})
+            now_showing.rebuild({now_showing.show_date(show.show_time_start) for show in shows})
+            schedule_cache.invalidate()
+        return len(shows), errors
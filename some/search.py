@@ -0,0 +1,156 @@
+import heapq
+import re
+import threading
+import time
+import unicodedata
+from bisect import bisect_left, insort
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from some import schedule_cache
+from some.models import Film, Place
+
+WORD = re.compile(r'\w+')
+# names are reloaded after this many seconds, without a shared cache nothing else tells
+# about names written by other processes
+SEARCH_INDEX_TTL = getattr(settings, 'SEARCH_INDEX_TTL', 60)
+
+
+def normalize(text):
+    # lower case without accents, so 'Amélie' is found by 'ame'
+    text = unicodedata.normalize('NFKD', text.casefold())
+    return ''.join(char for char in text if not unicodedata.combining(char))
+
+
+def tokenize(text):
+    return WORD.findall(normalize(text))
+
+
+class SearchIndex:
+    # inverted index of the names of a model: sorted terms for prefix lookups and the ids of names
+    # containing each term, loaded on first use and kept up to date by signals; reloaded when its version
+    # in the shared cache shows a change made by another process, or after SEARCH_INDEX_TTL
+
+    def __init__(self, model):
+        self.model = model
+        self.version_key = f'search:{model._meta.model_name}'
+        self.names = None
+        self.normalized = {}
+        self.terms = []
+        self.postings = {}
+        self.version = None
+        self.loaded = 0
+        self.lock = threading.Lock()
+
+    def load(self):
+        # caller holds the lock
+        version = schedule_cache.counter(self.version_key)
+        if self.names is not None and version == self.version \
+                and time.monotonic() - self.loaded <= SEARCH_INDEX_TTL:
+            return
+        # first use, names were changed by another process or the index is too old
+        self.names, self.normalized, self.terms, self.postings = {}, {}, [], {}
+        self.version = version
+        self.loaded = time.monotonic()
+        for object_id, name in self.model.objects.values_list('id', 'name'):
+            self.add(object_id, name)
+
+    def add(self, object_id, name):
+        self.names[object_id] = name
+        self.normalized[object_id] = normalize(name)
+        for term in set(WORD.findall(self.normalized[object_id])):
+            ids = self.postings.get(term)
+            if ids is None:
+                ids = self.postings[term] = set()
+                insort(self.terms, term)
+            ids.add(object_id)
+
+    def remove(self, object_id):
+        if self.names.pop(object_id, None) is None:
+            return
+        for term in set(WORD.findall(self.normalized.pop(object_id))):
+            ids = self.postings[term]
+            ids.discard(object_id)
+            if not ids:
+                del self.postings[term]
+                del self.terms[bisect_left(self.terms, term)]
+
+    def matching(self, prefix):
+        # ids of names with a word starting with prefix
+        ids = set()
+        for i in range(bisect_left(self.terms, prefix), len(self.terms)):
+            term = self.terms[i]
+            if not term.startswith(prefix):
+                break
+            ids |= self.postings[term]
+        return ids
+
+    def search(self, query, limit=10):
+        # (id, name) of names having words that start with every word of the query,
+        # names starting with the query first, then shorter ones
+        words = tokenize(query)
+        if not words:
+            return []
+        with self.lock:
+            self.load()
+            # the longest word usually matches the fewest names
+            words.sort(key=len, reverse=True)
+            ids = self.matching(words[0])
+            for word in words[1:]:
+                if not ids:
+                    break
+                ids &= self.matching(word)
+            start = normalize(query.strip())
+            best = heapq.nsmallest(limit, ids, key=lambda object_id: (
+                not self.normalized[object_id].startswith(start), len(self.names[object_id]), self.names[object_id]))
+            return [(object_id, self.names[object_id]) for object_id in best]
+
+    def update(self, instance):
+        with self.lock:
+            if self.names is not None:
+                self.remove(instance.id)
+                self.add(instance.id, instance.name)
+        transaction.on_commit(self.changed)
+
+    def discard(self, object_id):
+        with self.lock:
+            if self.names is not None:
+                self.remove(object_id)
+        transaction.on_commit(self.changed)
+
+    def changed(self):
+        # tell the other processes, this one is up to date unless names were changed elsewhere meanwhile
+        version = schedule_cache.bump(self.version_key)
+        with self.lock:
+            if version is None or self.names is None:
+                return
+            if self.version == version - 1:
+                self.version = version
+            else:
+                self.names = None
+
+    def reset(self):
+        # forget everything after names were written without signals, e.g. by bulk_create, in every process
+        with self.lock:
+            self.names = None
+        schedule_cache.bump(self.version_key)
+
+
+film_index = SearchIndex(Film)
+place_index = SearchIndex(Place)
+indexes = {Film: film_index, Place: place_index}
+
+
+@receiver(post_save, sender=Film)
+@receiver(post_save, sender=Place)
+def update_search_index(sender, instance, **kwargs):
+    indexes[sender].update(instance)
+
+
+@receiver(post_delete, sender=Film)
+@receiver(post_delete, sender=Place)
+def discard_from_search_index(sender, instance, **kwargs):
+    indexes[sender].discard(instance.id)
@@ -0,0 +1,73 @@
+from django.db import transaction
+from django.db.models import F
+
+from some.models import Show
+from some.reservations import seats_changed, sell
+
+
+class SeatError(Exception):
+    pass
+
+
+class SeatTaken(SeatError):
+    # a chosen seat belongs to someone else, the client should pick other seats
+    pass
+
+
+def seat_index(place, row, seat):
+    # position of the seat in the bitmap, rows and seats are counted from 1
+    index = (row - 1) * place.row_size + seat - 1
+    if not (1 <= row <= place.rows and 1 <= seat <= place.row_size and index < place.size):
+        raise SeatError(f'there is no seat {seat} in row {row}')
+    return index
+
+
+def unpack(bitmap, size):
+    # bytes from the database -> bytearray long enough for every seat of the place
+    bitmap = bytearray(bitmap or b'')
+    bitmap.extend(bytes((size + 7) // 8 - len(bitmap)))
+    return bitmap
+
+
+def is_taken(bitmap, index):
+    return bool(bitmap[index >> 3] & (1 << (index & 7)))
+
+
+def seat_map(show):
+    # taken seats as [row, seat] pairs plus the count of free ones; busy also counts seats
+    # sold or held without a number, so free comes from it rather than from the bitmap
+    place = show.place
+    bitmap = unpack(show.seats, place.size)
+    taken = [[index // place.row_size + 1, index % place.row_size + 1]
+             for index in range(place.size) if is_taken(bitmap, index)]
+    return {'rows': place.rows, 'row_size': place.row_size, 'size': place.size,
+            'taken': taken, 'free': max(place.size - show.busy, 0)}
+
+
+def claim_seats(show, user_id, seats):
+    # mark seats as taken and create the order in one transaction, the UPDATE only passes if nobody
+    # has changed the bitmap since we read it; returns None if somebody has, so the client may retry
+    place = show.place
+    indexes = {seat_index(place, row, seat) for row, seat in seats}
+    if not indexes:
+        raise SeatError('no seats chosen')
+    old = bytes(show.seats or b'')
+    bitmap = unpack(old, place.size)
+    for index in indexes:
+        if is_taken(bitmap, index):
+            raise SeatTaken(f'seat {index % place.row_size + 1} in row {index // place.row_size + 1} is taken')
+        bitmap[index >> 3] |= 1 << (index & 7)
+    amount = len(indexes)
+    if show.busy > place.size - amount:
+        raise SeatError('not enough places in hall')
+    with transaction.atomic():
+        claimed = Show.objects.filter(id=show.id, seats=old, busy__lte=place.size - amount) \
+            .update(seats=bytes(bitmap), busy=F('busy') + amount)
+        if not claimed:
+            if Show.objects.filter(id=show.id, seats=old).exists():
+                # the bitmap is the same, tickets sold without seats have filled the hall
+                raise SeatError('not enough places in hall')
+            return None
+        show.seats = bytes(bitmap)
+        seats_changed(show.id)
+        return sell(show.id, user_id, amount)
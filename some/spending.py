@@ -0,0 +1,39 @@
+from django.db import transaction, IntegrityError
+from django.db.models import F, Sum, Subquery
+
+from some.models import Show, Order, Spending
+
+
+def add_spending(user_id, show_id, amount):
+    # count a new order of the user, call it in the transaction creating the order
+    price = Subquery(Show.objects.filter(id=show_id).values('price')[:1])
+    add_spent(user_id, price * amount, amount)
+
+
+def add_spent(user_id, total, tickets):
+    # the same for several orders at once, total may be an expression
+    changes = {'total': F('total') + total, 'tickets': F('tickets') + tickets}
+    if Spending.objects.filter(user_id=user_id).update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            Spending.objects.create(user_id=user_id)
+    except IntegrityError:
+        # created by a concurrent order
+        pass
+    Spending.objects.filter(user_id=user_id).update(**changes)
+
+
+def get_total(user_id):
+    return Spending.objects.filter(user_id=user_id).values_list('total', flat=True).first() or 0
+
+
+def rebuild_spending(batch_size=1000):
+    # recount every user from orders, returns the number of users with orders
+    rows = Order.objects.values('user').annotate(total=Sum(F('amount') * F('show__price')), tickets=Sum('amount'))
+    with transaction.atomic():
+        Spending.objects.all().delete()
+        created = Spending.objects.bulk_create((Spending(user_id=row['user'], total=row['total'],
+                                                         tickets=row['tickets']) for row in rows.iterator()),
+                                               batch_size=batch_size)
+    return len(created)
@@ -1,3 +1,1019 @@
-from django.test import TestCase
+import asyncio
+import csv
+import datetime
+import io
+import json
+import os
+import tempfile
+import time
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core import mail
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import call_command, CommandError
+from django.db import connection, router
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from cinema.settings import TIME_TO_LOGOUT
+from some import now_showing, routers, schedule_cache
+from some.api.custom_authentication import TemporaryTokenAuthentication
+from some.api.custom_token import TemporaryToken
+from some.models import MyUser, Place, Film, Show, Order, IdempotencyKey, OutboxJob, SalesRollup, CalendarDay
+from some.analytics import rebuild_analytics
+from some.benchmarks import Seed, scenarios, run
+from some.events import broker, events_app
+from some.instrumentation import Recorder, Sample, recorder
+from some.now_showing import CALENDAR_MAX_DAYS
+from some.holds import hold_seats, confirm_hold, release_expired
+from some.idempotency import purge_expired
+from some.outbox import run_jobs, enqueue, handler, handlers, OUTBOX_MAX_ATTEMPTS
+from some.overlap import overlap_index, version_key, PlaceIntervals
+from some.reservations import reserve_seats
+from some.routers import REPLICA_DATABASE, read_from_replica
+from some.search import film_index, place_index, SEARCH_INDEX_TTL
+from some.seatmap import seat_index, unpack, is_taken, claim_seats, SeatError
+from some.spending import rebuild_spending
+from some.views import CSRF_MIDDLEWARE
+
+
+class ShowFixture:
+    # a user with an API client and one show of a film in a place, starting in an hour
+    price = 1
+
+    def setUp(self):
+        super().setUp()
+        today = datetime.date.today()
+        self.start = timezone.now() + datetime.timedelta(hours=1)
+        self.user = MyUser.objects.create_user(username='user', password='password', email='user@example.com')
+        self.place = Place.objects.create(name='place', size=10, rows=2)
+        self.film = Film.objects.create(name='film', begin=today, end=today + datetime.timedelta(days=2))
+        self.show = self.add_show(self.price)
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+
+    def add_show(self, price, hours=0):
+        # another show of the film in the place, `hours` after the first one
+        start = self.start + datetime.timedelta(hours=hours)
+        return Show.objects.create(place=self.place, film=self.film, price=price, show_time_start=start,
+                                   show_time_end=start + datetime.timedelta(hours=2))
+
+    def authenticate_admin(self):
+        self.api.force_authenticate(MyUser.objects.create_user(username='admin', password='admin', is_staff=True))
+
+
+class QueryCountTest(TestCase):
+    # listings must cost the same number of queries whatever the page size is
+    shows = 10
+
+    @classmethod
+    def setUpTestData(cls):
+        today = datetime.date.today()
+        cls.user = MyUser.objects.create_user(username='user', password='password')
+        start = timezone.now() + datetime.timedelta(hours=1)
+        for i in range(cls.shows):
+            place = Place.objects.create(name=f'place {i}', size=10)
+            film = Film.objects.create(name=f'film {i}', begin=today, end=today + datetime.timedelta(days=2))
+            show = Show.objects.create(place=place, film=film, price=i + 1, show_time_start=start,
+                                       show_time_end=start + datetime.timedelta(hours=2))
+            Order.objects.create(user=cls.user, show=show, amount=1)
+        rebuild_spending()
+
+    def setUp(self):
+        schedule_cache.local_cache.clear()
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+
+    def test_show_list_api(self):
+        with self.assertNumQueries(1):
+            response = self.api.get('/api/shows/')
+        self.assertEqual(len(response.data['results']), self.shows)
+
+    def test_show_list_api_filtered(self):
+        with self.assertNumQueries(1):
+            response = self.api.get('/api/shows/', {'place': 'place 1', 'sort': 'price'})
+        self.assertEqual(len(response.data['results']), 1)
+
+    def test_show_retrieve_api(self):
+        show = Show.objects.first()
+        with self.assertNumQueries(1):
+            self.api.get(f'/api/shows/{show.id}/')
+
+    def test_order_list_api(self):
+        # total + orders
+        with self.assertNumQueries(2):
+            response = self.api.get('/api/orders/')
+        self.assertEqual(len(response.data['results']['orders']), self.shows)
+        self.assertEqual(response.data['results']['total'], sum(range(1, self.shows + 1)))
+
+    def test_show_list_html(self):
+        # count + page
+        with self.assertNumQueries(2):
+            self.client.get(reverse('main'))
+
+    def test_order_list_html(self):
+        # session handling depends on the middleware, so compare with a longer history instead
+        self.client.force_login(self.user)
+        self.client.get(reverse('orders'))
+        with CaptureQueriesContext(connection) as short:
+            self.client.get(reverse('orders'))
+        Order.objects.bulk_create(Order(user=self.user, show=show, amount=2) for show in Show.objects.all())
+        with CaptureQueriesContext(connection) as long:
+            response = self.client.get(reverse('orders'))
+        self.assertEqual(len(response.context['object_list']), self.shows * 2)
+        self.assertEqual(len(short), len(long))
+
+
+class ScheduleCacheTest(ShowFixture, TestCase):
+
+    def setUp(self):
+        schedule_cache.local_cache.clear()
+        super().setUp()
+
+    def test_hit_without_database(self):
+        first = self.client.get('/api/shows/', {'sort': 'price'})
+        with self.assertNumQueries(0):
+            second = self.client.get('/api/shows/', {'sort': 'price'})
+        self.assertEqual(first.content, second.content)
+
+    def test_html_hit_without_database(self):
+        self.client.get(reverse('main'), {'date': 'today'})
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('main'), {'date': 'today'})
+        self.assertEqual(response.context['page_obj'].paginator.count, 1)
+
+    def test_invalidated_on_save(self):
+        self.client.get('/api/shows/')
+        self.show.price = 5
+        self.show.save()
+        response = self.client.get('/api/shows/')
+        self.assertEqual(response.data['results'][0]['price'], 5)
+
+    @override_settings(ALLOWED_HOSTS=['*'])
+    def test_links_of_each_host(self):
+        self.add_show(2, hours=3)
+        self.client.get('/api/shows/', {'page_size': 1}, HTTP_HOST='one.example.com')
+        response = self.client.get('/api/shows/', {'page_size': 1}, HTTP_HOST='two.example.com')
+        self.assertTrue(response.data['next'].startswith('http://two.example.com/'))
+
+    def test_lru_is_bounded(self):
+        cache = schedule_cache.LRUCache(2)
+        for key in 'abc':
+            cache.set(key, key)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('c'), 'c')
+
+
+class CursorPaginationTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        today = datetime.date.today()
+        start = timezone.now() + datetime.timedelta(hours=1)
+        place = Place.objects.create(name='place', size=10)
+        film = Film.objects.create(name='film', begin=today, end=today + datetime.timedelta(days=2))
+        Show.objects.bulk_create(Show(place=place, film=film, price=25 - i, show_time_start=start,
+                                      show_time_end=start + datetime.timedelta(hours=2)) for i in range(25))
+
+    def setUp(self):
+        schedule_cache.local_cache.clear()
+
+    def walk(self, params, field='price'):
+        response = self.client.get('/api/shows/', params)
+        values = [show[field] for show in response.data['results']]
+        while response.data['next']:
+            with self.assertNumQueries(1):
+                response = self.client.get(response.data['next'])
+            values += [show[field] for show in response.data['results']]
+        return values
+
+    def test_walks_every_show(self):
+        self.assertEqual(len(self.walk({})), 25)
+
+    def test_sort_by_price(self):
+        self.assertEqual(self.walk({'sort': 'price'}), list(range(1, 26)))
+
+    def test_more_ties_than_offset_cutoff(self):
+        show = Show.objects.first()
+        Show.objects.bulk_create(Show(place=show.place, film=show.film, price=30, show_time_start=show.show_time_start,
+                                      show_time_end=show.show_time_end) for _ in range(1100))
+        for params in ({'sort': 'price', 'page_size': 100}, {'page_size': 100}):
+            ids = self.walk(params, 'id')
+            self.assertEqual((len(ids), len(set(ids))), (1125, 1125))
+        first = self.client.get('/api/shows/', {'sort': 'price', 'page_size': 100}).data
+        second = self.client.get(first['next']).data
+        back = self.client.get(second['previous']).data
+        self.assertEqual([row['id'] for row in back['results']], [row['id'] for row in first['results']])
+
+
+class ExplainQueriesTest(TestCase):
+
+    def test_indexes_used(self):
+        out = io.StringIO()
+        call_command('explain_queries', stdout=out)
+        report = dict(line.split(': ', 1) for line in out.getvalue().splitlines() if ': ' in line)
+        for name in ('api shows', 'api shows of place', 'api orders', 'html orders', 'show overlap',
+                     'place max busy', 'orders total'):
+            self.assertEqual((name, report[name]), (name, 'ok'))
+
+
+class OverlapTest(TestCase):
+
+    def setUp(self):
+        overlap_index.reset()
+        today = datetime.date.today()
+        self.start = timezone.now() + datetime.timedelta(days=1)
+        self.place = Place.objects.create(name='place', size=10)
+        self.film = Film.objects.create(name='film', begin=today, end=today + datetime.timedelta(days=3))
+        self.show = Show.objects.create(place=self.place, film=self.film, price=1, show_time_start=self.start,
+                                        show_time_end=self.start + datetime.timedelta(hours=3))
+        self.api = APIClient()
+        self.api.force_authenticate(MyUser.objects.create_user(username='admin', password='admin', is_staff=True))
+
+    def post(self, start, end):
+        return self.api.post('/api/shows/', {
+            'place': self.place.id, 'film': self.film.id, 'price': 1,
+            'show_time_start': self.start + datetime.timedelta(hours=start),
+            'show_time_end': self.start + datetime.timedelta(hours=end)})
+
+    def test_overlapping(self):
+        self.assertEqual(self.post(2, 4).status_code, 400)
+        self.assertEqual(self.post(-1, 1).status_code, 400)
+
+    def test_contained(self):
+        self.assertEqual(self.post(1, 2).status_code, 400)
+        self.assertEqual(self.post(-1, 4).status_code, 400)
+
+    def test_back_to_back(self):
+        self.assertEqual(self.post(3, 5).status_code, 201)
+        self.assertEqual(self.post(4, 6).status_code, 400)
+
+    def test_deleted_show_frees_place(self):
+        self.show.delete()
+        self.assertEqual(self.post(1, 2).status_code, 201)
+
+    def test_overlapping_stored_shows(self):
+        # data written before the check may overlap, the longer show still conflicts
+        self.assertEqual(PlaceIntervals([(1, 10, 1), (2, 3, 2)]).conflict(5, 6), 1)
+        self.assertIsNone(PlaceIntervals([(1, 10, 1), (2, 3, 2)]).conflict(10, 12))
+
+    def test_checked_again_when_writing(self):
+        self.assertEqual(self.post(10, 11).status_code, 201)
+        # written by another process, the index of this one doesn't know about it
+        hour = datetime.timedelta(hours=1)
+        other = Show.objects.bulk_create([Show(place=self.place, film=self.film, price=1,
+                                               show_time_start=self.start + 4 * hour,
+                                               show_time_end=self.start + 6 * hour)])[0]
+        self.assertIsNone(overlap_index.conflict(self.place.id, self.start + 5 * hour, self.start + 7 * hour))
+        self.assertEqual(self.post(5, 7).status_code, 400)
+        self.assertEqual(overlap_index.conflicts([(self.place.id, self.start + 5 * hour, self.start + 7 * hour)],
+                                                 locked=True), {0: Show.objects.get(show_time_end=other.show_time_end).id})
+
+    def test_reloaded_only_for_changes_elsewhere(self):
+        hour = datetime.timedelta(hours=1)
+        with self.settings(CACHES=SHARED_CACHES):
+            cache.clear()
+            overlap_index.conflict(self.place.id, self.start, self.start + hour)
+            # saving another show keeps the index, with the show in it
+            show = Show.objects.create(place=self.place, film=self.film, price=1,
+                                       show_time_start=self.start + 5 * hour, show_time_end=self.start + 6 * hour)
+            overlap_index.changed(self.place.id)
+            with self.assertNumQueries(0):
+                self.assertEqual(overlap_index.conflict(self.place.id, self.start + 5 * hour, self.start + 7 * hour),
+                                 show.id)
+            # a show of the place written by another process
+            schedule_cache.bump(version_key(self.place.id))
+            with self.assertNumQueries(1):
+                overlap_index.conflict(self.place.id, self.start, self.start + hour)
+
+    def test_batch(self):
+        hour = datetime.timedelta(hours=1)
+        errors = overlap_index.conflicts([(self.place.id, self.start + 3 * hour, self.start + 5 * hour),
+                                          (self.place.id, self.start + hour, self.start + 2 * hour),
+                                          (self.place.id, self.start + 4 * hour, self.start + 6 * hour)])
+        self.assertEqual(errors, {1: self.show.id, 2: None})
+
+
+class ScheduleImportTest(TestCase):
+
+    def setUp(self):
+        overlap_index.reset()
+        today = datetime.date.today()
+        self.start = timezone.now().replace(microsecond=0) + datetime.timedelta(days=1)
+        self.place = Place.objects.create(name='place', size=10)
+        self.film = Film.objects.create(name='film', begin=today, end=today + datetime.timedelta(days=3))
+        self.api = APIClient()
+        self.api.force_authenticate(MyUser.objects.create_user(username='admin', password='admin', is_staff=True))
+
+    def row(self, start, end, place='place'):
+        return f'{place},film,{(self.start + datetime.timedelta(hours=start)).isoformat()},' \
+               f'{(self.start + datetime.timedelta(hours=end)).isoformat()},10\n'
+
+    def test_csv(self):
+        body = 'place,film,show_time_start,show_time_end,price\n' + \
+               self.row(0, 2) + self.row(2, 4) + self.row(3, 5) + self.row(0, 2, place='nowhere')
+        response = self.api.post('/api/shows/import_schedule/', body, content_type='text/csv')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual(set(response.data['errors']), {3, 4})
+        self.assertEqual(Show.objects.count(), 2)
+        # imported shows are known to the overlap check
+        end = self.start + datetime.timedelta(hours=1)
+        self.assertIsNotNone(overlap_index.conflict(self.place.id, self.start, end))
+
+    def test_ndjson(self):
+        body = '\n'.join(json.dumps({'place': self.place.id, 'film': self.film.name, 'price': 1,
+                                     'show_time_start': (self.start + datetime.timedelta(hours=i)).isoformat(),
+                                     'show_time_end': (self.start + datetime.timedelta(hours=i + 1)).isoformat()})
+                         for i in range(3))
+        response = self.api.post('/api/shows/import_schedule/', body, content_type='application/x-ndjson')
+        self.assertEqual(response.data, {'created': 3, 'errors': {}})
+
+    def test_dry_run(self):
+        body = json.dumps([{'place': 'place', 'film': 'film', 'price': 1,
+                            'show_time_start': self.start.isoformat(),
+                            'show_time_end': (self.start + datetime.timedelta(hours=1)).isoformat()}])
+        response = self.api.post('/api/shows/import_schedule/?dry_run', body, content_type='application/json')
+        self.assertEqual(response.data['created'], 1)
+        self.assertFalse(Show.objects.exists())
+
+    def test_command_from_stdin(self):
+        body = 'place,film,show_time_start,show_time_end,price\n' + self.row(1, 2)
+        stdin = io.StringIO(body)
+        with mock.patch('sys.stdin', stdin):
+            call_command('import_schedule', '-', format='csv', stdout=io.StringIO(), stderr=io.StringIO())
+        self.assertFalse(stdin.closed)
+        self.assertEqual(Show.objects.count(), 1)
+        with mock.patch('sys.stdin', io.StringIO(body + 'x' * (csv.field_size_limit() + 1))):
+            with self.assertRaisesMessage(CommandError, 'cant read schedule'):
+                call_command('import_schedule', '-', format='csv', stdout=io.StringIO(), stderr=io.StringIO())
+
+
+class TokenAuthenticationTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        user = MyUser.objects.create_user(username='user', password='password')
+        self.token, created = TemporaryToken.objects.get_or_create(user=user)
+        self.api = APIClient(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_no_writes_within_granularity(self):
+        self.api.get('/api/orders/')
+        with self.assertNumQueries(2):
+            response = self.api.get('/api/orders/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_last_action_persisted_after_granularity(self):
+        old = timezone.now() - TemporaryTokenAuthentication.activity_granularity - datetime.timedelta(seconds=1)
+        TemporaryToken.objects.filter(pk=self.token.pk).update(last_action=old)
+        self.api.get('/api/orders/')
+        self.token.refresh_from_db()
+        self.assertGreater(self.token.last_action, old)
+
+
+class AutoLogoutTest(TestCase):
+
+    def setUp(self):
+        self.client.force_login(MyUser.objects.create_user(username='user', password='password'))
+
+    def test_session_written_once_per_bucket(self):
+        self.client.get(reverse('orders'))
+        stamp = self.client.session['time']
+        self.assertIsInstance(stamp, int)
+        with self.assertNumQueries(4):
+            self.client.get(reverse('orders'))
+        self.assertEqual(self.client.session['time'], stamp)
+
+    def test_logout_after_idle(self):
+        session = self.client.session
+        session['time'] = int(time.time() - TIME_TO_LOGOUT.total_seconds()) - 1
+        session.save()
+        response = self.client.get(reverse('orders'))
+        self.assertEqual(response.status_code, 302)
+
+
+class ReservationTest(ShowFixture, TestCase):
+
+    def test_capacity_guard(self):
+        self.assertIsNotNone(reserve_seats(self.show.id, self.user.id, 7))
+        self.assertIsNone(reserve_seats(self.show.id, self.user.id, 4))
+        with CaptureQueriesContext(connection) as queries:
+            self.assertIsNotNone(reserve_seats(self.show.id, self.user.id, 3))
+        self.assertIsNone(reserve_seats(self.show.id, self.user.id, 1))
+        self.show.refresh_from_db()
+        self.assertEqual((self.show.busy, Order.objects.count()), (10, 2))
+        # the size is checked on the updated row, not by selecting ids of a join first
+        update = next(q['sql'] for q in queries.captured_queries if q['sql'].startswith('UPDATE "some_show"'))
+        self.assertNotIn('JOIN', update)
+        self.assertNotIn('IN (SELECT', update)
+
+
+class SeatMapTest(ShowFixture, TestCase):
+    # the place has 10 seats in 2 rows of 5
+
+    def seats(self, *seats):
+        return self.api.post(f'/api/shows/{self.show.id}/seats/', {'seats': seats}, format='json')
+
+    def test_bitmap(self):
+        self.assertEqual((seat_index(self.place, 1, 1), seat_index(self.place, 2, 5)), (0, 9))
+        with self.assertRaises(SeatError):
+            seat_index(self.place, 3, 1)
+        bitmap = unpack(b'\x01', self.place.size)
+        self.assertEqual(len(bitmap), 2)
+        self.assertEqual([is_taken(bitmap, index) for index in range(3)], [True, False, False])
+
+    def test_claim_and_map(self):
+        self.assertEqual(self.seats([1, 2], [2, 5]).status_code, 201)
+        reserve_seats(self.show.id, self.user.id, 3)
+        seat_map = self.client.get(f'/api/shows/{self.show.id}/seats/').data
+        # seats sold without numbers are not free either
+        self.assertEqual((seat_map['taken'], seat_map['free']), ([[1, 2], [2, 5]], 5))
+        self.assertEqual(self.seats([1, 2]).status_code, 409)
+        self.assertEqual(self.seats([3, 1]).status_code, 400)
+
+    def test_full_hall_is_not_a_conflict(self):
+        reserve_seats(self.show.id, self.user.id, 9)
+        self.assertEqual(self.seats([1, 1], [1, 2]).status_code, 400)
+        # the show read by the view is behind, the UPDATE tells the full hall from a lost race
+        show = Show.objects.select_related('place').get(id=self.show.id)
+        reserve_seats(self.show.id, self.user.id, 1)
+        with self.assertRaises(SeatError):
+            claim_seats(show, self.user.id, [[1, 1]])
+        # a lost race is a conflict the client may retry
+        Show.objects.filter(id=show.id).update(busy=0)
+        show.refresh_from_db()
+        Show.objects.filter(id=show.id).update(seats=b'\x02', busy=1)
+        self.assertIsNone(claim_seats(show, self.user.id, [[1, 1]]))
+
+    def test_rows_validated(self):
+        with self.assertRaises(ValidationError):
+            Place(name='empty', size=10, rows=0).full_clean()
+
+
+@skipUnless(REPLICA_DATABASE in settings.DATABASES, 'needs a replica database alias')
+@override_settings(DATABASE_ROUTERS=['some.routers.ReplicaRouter'])
+class ReplicaRouterTest(ShowFixture, TestCase):
+    # the replica is a test database of its own, rows written by the tests only reach the primary
+    databases = {'default', REPLICA_DATABASE}
+
+    def setUp(self):
+        cache.clear()
+        super().setUp()
+        Order.objects.create(user=self.user, show=self.show, amount=2)
+
+    def test_reads_routed(self):
+        with read_from_replica():
+            self.assertFalse(Show.objects.exists())
+            self.assertEqual(router.db_for_write(Show), 'default')
+        self.assertTrue(Show.objects.exists())
+        # without the replica alias reads stay on the primary
+        with mock.patch.object(routers, 'REPLICA_DATABASE', 'missing'), read_from_replica():
+            self.assertTrue(Show.objects.exists())
+
+    def test_pinned_after_purchase(self):
+        self.assertEqual(self.api.get('/api/orders/').data['results']['orders'], [])
+        self.api.post(f'/api/shows/{self.show.id}/create_order/', {'amount': 1})
+        self.assertEqual(len(self.api.get('/api/orders/').data['results']['orders']), 2)
+
+    def test_warns_about_local_pins(self):
+        with self.assertLogs('some.routers', 'WARNING'):
+            routers.ReplicaRouter()
+
+
+class SpendingTest(ShowFixture, TestCase):
+    price = 7
+
+    def test_orders_counted(self):
+        self.api.post(f'/api/shows/{self.show.id}/create_order/', {'amount': 2})
+        self.api.post(f'/api/shows/{self.show.id}/seats/', {'seats': [[1, 1], [2, 3]]}, format='json')
+        self.assertEqual((self.user.spending.total, self.user.spending.tickets), (28, 4))
+        self.assertEqual(self.api.get('/api/orders/').data['results']['total'], 28)
+
+    def test_rebuild(self):
+        Order.objects.create(user=self.user, show=self.show, amount=3)
+        self.assertEqual(rebuild_spending(), 1)
+        self.assertEqual(self.api.get('/api/orders/').data['results']['total'], 21)
+
+
+class IdempotencyTest(ShowFixture, TestCase):
+    price = 7
+
+    def setUp(self):
+        super().setUp()
+        self.url = f'/api/shows/{self.show.id}/create_order/'
+
+    def test_replay(self):
+        first = self.api.post(self.url, {'amount': 2}, HTTP_IDEMPOTENCY_KEY='abc')
+        with CaptureQueriesContext(connection) as queries:
+            again = self.api.post(self.url, {'amount': 2}, HTTP_IDEMPOTENCY_KEY='abc')
+        self.assertEqual((again.status_code, again.data), (first.status_code, first.data))
+        self.assertEqual(again['Idempotent-Replayed'], 'true')
+        self.assertFalse([q for q in queries.captured_queries if 'some_show' in q['sql']])
+        self.assertEqual(Order.objects.count(), 1)
+        self.api.post(self.url, {'amount': 2}, HTTP_IDEMPOTENCY_KEY='def')
+        self.assertEqual(Order.objects.count(), 2)
+
+    def test_other_path_and_expiry(self):
+        self.api.post(self.url, {'amount': 2}, HTTP_IDEMPOTENCY_KEY='abc')
+        other = self.api.post(f'/api/shows/{self.show.id}/seats/', {'seats': [[1, 1]]}, format='json',
+                              HTTP_IDEMPOTENCY_KEY='abc')
+        self.assertEqual(other.status_code, 422)
+        IdempotencyKey.objects.update(expires=timezone.now())
+        self.assertEqual(purge_expired(), 1)
+        self.api.post(self.url, {'amount': 2}, HTTP_IDEMPOTENCY_KEY='abc')
+        self.assertEqual(Order.objects.count(), 2)
+
+
+class SeatHoldTest(ShowFixture, TestCase):
+    price = 7
+
+    def busy(self):
+        self.show.refresh_from_db()
+        return self.show.busy
+
+    def test_confirm_and_release(self):
+        hold = self.api.post(f'/api/shows/{self.show.id}/hold/', {'amount': 6}).data
+        self.assertEqual(self.busy(), 6)
+        self.assertEqual(self.api.post(f'/api/shows/{self.show.id}/hold/', {'amount': 5}).status_code, 400)
+        self.assertEqual(self.api.post(f"/api/holds/{hold['id']}/confirm/").data, {'tickets': 6})
+        self.assertEqual(self.api.post(f"/api/holds/{hold['id']}/confirm/").status_code, 404)
+        self.assertEqual((self.busy(), Order.objects.get().amount), (6, 6))
+
+        hold = self.api.post(f'/api/shows/{self.show.id}/hold/', {'amount': 3}).data
+        self.assertEqual(self.api.delete(f"/api/holds/{hold['id']}/").status_code, 204)
+        self.assertEqual((self.busy(), Order.objects.count()), (6, 1))
+
+    def test_expired_released(self):
+        hold_seats(self.show.id, self.user.id, 2)
+        hold = hold_seats(self.show.id, self.user.id, 3, duration=datetime.timedelta(0))
+        self.assertEqual(self.busy(), 5)
+        self.assertIsNone(confirm_hold(hold.id, self.user.id))
+        self.assertEqual(release_expired(batch_size=1), 1)
+        self.assertEqual(self.busy(), 2)
+        self.assertEqual(len(self.api.get('/api/holds/').data), 1)
+
+
+class BenchmarkTest(TestCase):
+
+    def test_scenarios_run(self):
+        seed = Seed('bench-test', films=3, places=2, shows=20, orders=30, users=4).create()
+        self.assertEqual(Show.objects.count(), 20)
+        self.assertEqual(sum(Order.objects.values_list('amount', flat=True)),
+                         sum(Show.objects.values_list('busy', flat=True)))
+        for scenario in scenarios(seed):
+            result = run(scenario, seed, requests=2, threads=1)
+            self.assertEqual((scenario.name, result['requests'], result['errors']), (scenario.name, 2, 0))
+        seed.delete()
+        self.assertFalse(Show.objects.exists())
+        # no signal per show, the calendar is rebuilt once
+        self.assertFalse(OutboxJob.objects.filter(kind='days').exists())
+        self.assertFalse(any(CalendarDay.objects.values_list('data', flat=True)))
+
+
+@override_settings(MIDDLEWARE=['some.middleware.Instrumentation'] + settings.MIDDLEWARE)
+class InstrumentationTest(TestCase):
+
+    def setUp(self):
+        recorder.clear()
+        self.addCleanup(recorder.clear)
+        Place.objects.create(name='place', size=10)
+        self.api = APIClient()
+        self.api.force_authenticate(MyUser.objects.create_superuser(username='admin', password='password'))
+
+    def test_recorded_per_view(self):
+        self.api.get('/api/places/')
+        self.api.get('/api/places/')
+        data = self.api.get('/api/instrumentation/').data
+        places = data['place-list']
+        self.assertEqual(places['requests'], 2)
+        self.assertGreaterEqual(places['queries'], 1)
+        self.assertGreater(places['serializer_ms'], 0)
+        self.assertEqual(sum(places['buckets'].values()), 2)
+        self.assertIn('cinema_request_duration_seconds_count{view="place-list"} 2', recorder.prometheus())
+
+    def test_slowest_profiles_kept(self):
+        slowest = Recorder(profiles=2)
+        for wall in (0.1, 0.3, 0.2):
+            with slowest.profile(rate=1) as profiler:
+                sum(range(100))
+            sample = Sample('GET')
+            sample.view, sample.wall = 'view', wall
+            slowest.add(sample, profiler)
+        profiles = slowest.slowest()
+        self.assertEqual([profile['wall_ms'] for profile in profiles], [300, 200])
+        self.assertIn('function calls', profiles[0]['profile'])
+
+
+class OutboxTest(ShowFixture, TestCase):
+    price = 5
+
+    def setUp(self):
+        super().setUp()
+        # the calendar day of the new show
+        run_jobs()
+
+    def test_after_purchase_batched(self):
+        reserve_seats(self.show.id, self.user.id, 2)
+        reserve_seats(self.show.id, self.user.id, 3)
+        self.assertEqual((OutboxJob.objects.filter(kind='order').count(), SalesRollup.objects.count()), (2, 0))
+        self.assertEqual(run_jobs(), 4)
+        self.assertEqual(list(SalesRollup.objects.values_list('tickets', 'revenue')), [(5, 25)])
+        self.assertEqual([message.to for message in mail.outbox], [['user@example.com']] * 2)
+        self.assertFalse(OutboxJob.objects.exists())
+
+    def test_failed_job_retried(self):
+        def flaky(payloads):
+            if {'fail': True} in payloads:
+                raise ValueError('downstream is down')
+        self.addCleanup(handlers.pop, 'flaky')
+        handler('flaky')(flaky)
+        enqueue('flaky', {'fail': True})
+        enqueue('flaky', {'fail': False})
+        run_jobs()
+        job = OutboxJob.objects.get()
+        self.assertEqual((job.payload, job.attempts), ({'fail': True}, 1))
+        self.assertGreater(job.available_at, timezone.now())
+        self.assertIn('downstream is down', job.error)
+        self.assertEqual(run_jobs(), 0)
+        OutboxJob.objects.update(available_at=timezone.now(), attempts=OUTBOX_MAX_ATTEMPTS - 1)
+        run_jobs()
+        self.assertIsNone(OutboxJob.objects.get().available_at)
+
+
+class CartCheckoutTest(ShowFixture, TestCase):
+    price = 5
+
+    def setUp(self):
+        super().setUp()
+        self.shows = [self.show, self.add_show(7, hours=3)]
+
+    def checkout(self, *items):
+        return self.api.post('/api/shows/checkout/', {'items': [{'show': show.id, 'amount': amount}
+                                                               for show, amount in items]}, format='json')
+
+    def test_all_shows_bought(self):
+        first, second = self.shows
+        response = self.checkout((second, 2), (first, 1), (second, 1))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(sorted(Order.objects.values_list('show_id', 'amount', 'user_id')),
+                         [(first.id, 1, self.user.id), (second.id, 3, self.user.id)])
+        self.assertEqual(list(Show.objects.order_by('id').values_list('busy', flat=True)), [1, 3])
+        self.assertEqual((self.user.spending.total, self.user.spending.tickets), (26, 4))
+        self.assertEqual(sorted(OutboxJob.objects.filter(kind='order').values_list('payload__order', flat=True)),
+                         sorted(Order.objects.values_list('id', flat=True)))
+
+    def test_nothing_bought_if_one_is_full(self):
+        first, second = self.shows
+        response = self.checkout((first, 2), (second, 11))
+        self.assertEqual((response.status_code, response.data['show']), (400, second.id))
+        self.assertEqual(list(Show.objects.values_list('busy', flat=True)), [0, 0])
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(self.checkout((first, 1), (Show(id=0), 1)).data['show'], 0)
+
+
+class SearchTest(TestCase):
+
+    def setUp(self):
+        film_index.reset()
+        place_index.reset()
+        today = datetime.date.today()
+        for name in ('The Matrix', 'Matrix Reloaded', 'Amélie', 'Mad Max: Fury Road'):
+            Film.objects.create(name=name, begin=today, end=today)
+        Place.objects.create(name='Main hall', size=10)
+
+    def names(self, query, kind='films'):
+        return [row['name'] for row in self.client.get('/api/search/', {'q': query}).data[kind]]
+
+    def test_prefix_search(self):
+        self.assertEqual(self.names('mat'), ['Matrix Reloaded', 'The Matrix'])
+        # names starting with the query first, shorter first
+        self.assertEqual(self.names('ma'), ['Matrix Reloaded', 'Mad Max: Fury Road', 'The Matrix'])
+        self.assertEqual(self.names('matrix re'), ['Matrix Reloaded'])
+        self.assertEqual(self.names('AME'), ['Amélie'])
+        self.assertEqual(self.names('ma', 'places'), ['Main hall'])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.names(''), [])
+            self.assertEqual(self.names('zz'), [])
+
+    def test_updated_by_signals(self):
+        self.names('mat')
+        film = Film.objects.get(name='The Matrix')
+        film.name = 'Inception'
+        film.save()
+        Film.objects.get(name='Amélie').delete()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.names('mat'), ['Matrix Reloaded'])
+            self.assertEqual(self.names('inc'), ['Inception'])
+            self.assertEqual(self.names('ame'), [])
+
+    def test_reloaded_only_for_name_changes_elsewhere(self):
+        with self.settings(CACHES=SHARED_CACHES):
+            cache.clear()
+            self.names('mat')
+            film = Film.objects.get(name='The Matrix')
+            Show.objects.create(place=Place.objects.get(), film=film, price=1, show_time_start=timezone.now(),
+                                show_time_end=timezone.now())
+            film.name = 'Matrix Revolutions'
+            film.save()
+            film_index.changed()
+            with self.assertNumQueries(0):
+                self.assertEqual(self.names('matrix'), ['Matrix Reloaded', 'Matrix Revolutions'])
+            # a film renamed by another process
+            schedule_cache.bump(film_index.version_key)
+            with self.assertNumQueries(1):
+                self.names('matrix')
+
+    def test_reloaded_after_ttl(self):
+        self.names('mat')
+        # written by another process, no signal reaches this one
+        Film.objects.bulk_create([Film(name='Matilda', begin=datetime.date.today(), end=datetime.date.today())])
+        self.assertEqual(self.names('mati'), [])
+        with mock.patch('some.search.time.monotonic', return_value=time.monotonic() + SEARCH_INDEX_TTL + 1):
+            self.assertEqual(self.names('mati'), ['Matilda'])
+
+
+class CalendarTest(TestCase):
+
+    def setUp(self):
+        today = timezone.localdate()
+        self.tomorrow = today + datetime.timedelta(days=1)
+        start = timezone.make_aware(datetime.datetime.combine(self.tomorrow, datetime.time(18)))
+        self.user = MyUser.objects.create_user(username='user', password='password')
+        self.place = Place.objects.create(name='place', size=10)
+        self.film = Film.objects.create(name='film', begin=today, end=today + datetime.timedelta(days=5))
+        self.show = Show.objects.create(place=self.place, film=self.film, price=5, show_time_start=start,
+                                        show_time_end=start + datetime.timedelta(hours=2))
+        run_jobs()
+
+    def days(self):
+        return {day['date']: day['films'] for day in self.client.get('/api/calendar/', {'days': 3}).data}
+
+    def test_read_from_materialized_days(self):
+        self.assertEqual(self.days()[self.tomorrow], [{'id': self.film.id, 'name': 'film', 'shows': [{
+            'id': self.show.id, 'start': self.show.show_time_start.isoformat(),
+            'end': self.show.show_time_end.isoformat(), 'price': 5, 'place': self.place.id,
+            'place_name': 'place', 'free': 10}]}])
+        call_command('build_calendar', days=3, stdout=io.StringIO())
+        reserve_seats(self.show.id, self.user.id, 3)
+        run_jobs()
+        with self.assertNumQueries(1):
+            self.assertEqual(self.days()[self.tomorrow][0]['shows'][0]['free'], 7)
+        self.assertContains(self.client.get('/calendar/'), '7 seats left')
+
+    def test_kept_up_to_date_by_signals(self):
+        self.days()
+        self.film.name = 'renamed'
+        self.film.save()
+        run_jobs()
+        self.assertEqual(self.days()[self.tomorrow][0]['name'], 'renamed')
+        self.show.show_time_start += datetime.timedelta(days=1)
+        self.show.show_time_end += datetime.timedelta(days=1)
+        self.show.save()
+        run_jobs()
+        days = self.days()
+        self.assertEqual(days[self.tomorrow], [])
+        self.assertEqual(days[self.tomorrow + datetime.timedelta(days=1)][0]['shows'][0]['id'], self.show.id)
+        self.show.delete()
+        run_jobs()
+        self.assertFalse(any(self.days().values()))
+
+    def test_day_rebuilt_once_for_many_shows(self):
+        for hour in (1, 2, 3):
+            start = self.show.show_time_start - datetime.timedelta(hours=hour * 4)
+            Show.objects.create(place=self.place, film=self.film, price=5, show_time_start=start,
+                                show_time_end=start + datetime.timedelta(hours=2))
+        run_jobs()
+        with mock.patch('some.now_showing.build_day', wraps=now_showing.build_day) as build_day:
+            self.film.delete()
+            run_jobs()
+        self.assertEqual(build_day.call_args_list, [mock.call(self.tomorrow)])
+        self.assertEqual(CalendarDay.objects.get(date=self.tomorrow).data, [])
+
+    def test_read_writes_nothing(self):
+        # the day of the show is materialized by its signal, the others are only built
+        self.assertEqual(list(CalendarDay.objects.values_list('date', flat=True)), [self.tomorrow])
+        days = self.client.get('/api/calendar/', {'days': 1000}).data
+        self.assertEqual(len(days), CALENDAR_MAX_DAYS)
+        self.assertEqual(days[1]['films'][0]['id'], self.film.id)
+        self.assertEqual(CalendarDay.objects.count(), 1)
+
+
+class SalesExportTest(ShowFixture, TestCase):
+    price = 7
+
+    def setUp(self):
+        super().setUp()
+        Order.objects.bulk_create(Order(user=self.user, show=self.show, amount=i + 1) for i in range(3))
+        self.authenticate_admin()
+
+    def test_csv(self):
+        response = self.api.get('/api/sales/export/')
+        rows = list(csv.reader(b''.join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(rows[0][-3:], ['price', 'film', 'place'])
+        self.assertEqual(rows[1][-3:], ['7', 'film', 'place'])
+
+    def test_ndjson(self):
+        response = self.api.get('/api/sales/export/', {'output': 'ndjson'})
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([row['amount'] for row in rows], [1, 2, 3])
+        self.assertEqual(rows[0]['film'], 'film')
+
+    def test_admin_only(self):
+        self.api.force_authenticate(MyUser.objects.create_user(username='user2', password='password'))
+        self.assertEqual(self.api.get('/api/sales/export/').status_code, 403)
+
+
+class AnalyticsTest(ShowFixture, TestCase):
+    price = 5
+
+    def setUp(self):
+        super().setUp()
+        self.authenticate_admin()
+
+    def test_orders_rolled_up(self):
+        reserve_seats(self.show.id, self.user.id, 2)
+        reserve_seats(self.show.id, self.user.id, 3)
+        run_jobs()
+        with self.assertNumQueries(1):
+            films = self.api.get('/api/analytics/films/').data
+        self.assertEqual([(row['film__name'], row['tickets'], row['revenue']) for row in films], [('film', 5, 25)])
+        places = self.api.get('/api/analytics/places/').data
+        self.assertEqual(places[0]['occupancy'], 50)
+        hours = self.api.get('/api/analytics/hours/').data
+        self.assertEqual(hours[0]['hour'], timezone.localtime(self.start).hour)
+
+    def test_rebuild(self):
+        Order.objects.create(user=self.user, show=self.show, amount=4)
+        self.assertEqual(rebuild_analytics(), 1)
+        self.assertEqual(self.api.get('/api/analytics/days/').data[0]['revenue'], 20)
+
+    def test_rebuild_leaves_pending_orders_to_outbox(self):
+        reserve_seats(self.show.id, self.user.id, 2)
+        run_jobs()
+        reserve_seats(self.show.id, self.user.id, 3)
+        rebuild_analytics()
+        self.assertEqual(list(SalesRollup.objects.values_list('tickets', flat=True)), [2])
+        run_jobs()
+        self.assertEqual(list(SalesRollup.objects.values_list('tickets', flat=True)), [5])
+        # a job that was given up on is not going to add its order
+        reserve_seats(self.show.id, self.user.id, 1)
+        OutboxJob.objects.filter(kind='order').update(available_at=None)
+        rebuild_analytics()
+        self.assertEqual(list(SalesRollup.objects.values_list('tickets', flat=True)), [6])
+
+    def test_wrong_period(self):
+        self.assertEqual(self.api.get('/api/analytics/days/', {'from': 'yesterday'}).status_code, 400)
+
+
+class FastSerializerTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        today = datetime.date.today()
+        start = timezone.now() + datetime.timedelta(hours=1)
+        cls.user = MyUser.objects.create_user(username='user', password='password')
+        place = Place.objects.create(name='place', size=10, rows=2)
+        film = Film.objects.create(name='film', begin=today, end=today + datetime.timedelta(days=2))
+        for i in range(3):
+            show = Show.objects.create(place=place, film=film, price=i + 1,
+                                       show_time_start=start + datetime.timedelta(hours=3 * i),
+                                       show_time_end=start + datetime.timedelta(hours=3 * i + 2))
+            reserve_seats(show.id, cls.user.id, i + 1)
+
+    def setUp(self):
+        schedule_cache.local_cache.clear()
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+
+    def assertSameBytes(self, url, params=None):
+        slow = self.api.get(url, params).content
+        schedule_cache.local_cache.clear()
+        with override_settings(FAST_SERIALIZERS=True):
+            fast = self.api.get(url, params).content
+        self.assertEqual(slow, fast)
+
+    def test_shows(self):
+        self.assertSameBytes('/api/shows/')
+        self.assertSameBytes('/api/shows/', {'sort': 'price', 'page_size': 2})
+
+    def test_fast_param(self):
+        slow = self.api.get('/api/shows/').content
+        schedule_cache.local_cache.clear()
+        self.assertEqual(self.api.get('/api/shows/', {'fast': 1}).content, slow)
+        # the page cached by the fast request is the same one plain requests get
+        self.assertEqual(self.api.get('/api/shows/').content, slow)
+        self.assertEqual(len(json.loads(slow)['results']), 3)
+
+    def test_orders(self):
+        self.assertSameBytes('/api/orders/')
+        self.assertSameBytes('/api/orders/', {'page_size': 1})
+
+
+# versions live in a cache shared between processes, a file based one stands in for it
+SHARED_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                             'LOCATION': os.path.join(tempfile.gettempdir(), 'cinema-tests-cache')}}
+
+
+@override_settings(CACHES=SHARED_CACHES)
+class ConditionalRequestTest(ShowFixture, TestCase):
+
+    def setUp(self):
+        cache.clear()
+        super().setUp()
+
+    def test_not_modified_without_queries(self):
+        for url in ('/api/shows/', '/api/places/', reverse('main')):
+            etag = self.client.get(url)['ETag']
+            with self.assertNumQueries(0):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+
+    def test_not_modified_after_csrf_cookie_is_set(self):
+        # the first response sets the cookie, the page and its tag already use its token
+        middleware = [name for name in settings.MIDDLEWARE if name != CSRF_MIDDLEWARE] + [CSRF_MIDDLEWARE]
+        with self.settings(MIDDLEWARE=middleware):
+            first = self.client.get(reverse('main'))
+            self.assertIn(settings.CSRF_COOKIE_NAME, first.cookies)
+            response = self.client.get(reverse('main'), HTTP_IF_NONE_MATCH=first['ETag'])
+            self.assertEqual(response.status_code, 304)
+            self.client.cookies.clear()
+            self.assertNotEqual(self.client.get(reverse('main'))['ETag'], first['ETag'])
+
+    def test_changed_by_save(self):
+        etag = self.client.get('/api/places/')['ETag']
+        self.place.save()
+        self.assertEqual(self.client.get('/api/places/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_changed_over_time(self):
+        # started shows leave the schedule without a signal
+        etag = self.client.get('/api/shows/')['ETag']
+        later = time.time() + schedule_cache.TIMEOUT
+        with mock.patch('time.time', return_value=later):
+            self.assertEqual(self.client.get('/api/shows/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_no_etag_without_shared_cache(self):
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            for url in ('/api/shows/', '/api/places/', reverse('main')):
+                self.assertFalse(self.client.get(url).has_header('ETag'))
+
+
+@override_settings(OUTBOX_WORKER=None, CACHES=SHARED_CACHES)
+class SaleConditionalRequestTest(ShowFixture, TransactionTestCase):
+    # the sales counter moves on commit
+
+    def setUp(self):
+        cache.clear()
+        super().setUp()
+
+    def test_changed_by_sale(self):
+        etag = self.client.get('/api/shows/')['ETag']
+        reserve_seats(self.show.id, self.user.id, 5)
+        response = self.client.get('/api/shows/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        # the new tag comes with the new page, not the one cached before the sale
+        self.assertEqual(response.data['results'][0]['busy'], 5)
+        self.assertEqual(self.client.get('/api/shows/', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+
+@override_settings(OUTBOX_WORKER=None)
+class EventsTest(ShowFixture, TransactionTestCase):
+
+    def test_burst_coalesced(self):
+        self.addCleanup(setattr, broker, 'interval', broker.interval)
+        broker.interval = 0.05
+        scope = {'type': 'http', 'path': '/api/events/', 'query_string': f'shows={self.show.id}'.encode()}
+
+        async def listen():
+            sent, received = [], []
+            disconnected = asyncio.Event()
+
+            async def receive():
+                # like a server: the request first, then nothing until the client goes away
+                if not received:
+                    received.append(True)
+                    return {'type': 'http.request', 'body': b'', 'more_body': False}
+                await disconnected.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                sent.append(message)
+                if len([m for m in sent if m.get('body', b'').startswith(b'data')]) == 1:
+                    # purchases right after the first state
+                    for _ in range(3):
+                        await sync_to_async(reserve_seats)(self.show.id, self.user.id, 1)
+                if len(sent) == 3:
+                    disconnected.set()
+
+            await asyncio.wait_for(events_app(scope, receive, send), 5)
+            self.assertEqual(sent[-1], {'type': 'http.response.body', 'body': b''})
+            return [json.loads(m['body'][6:]) for m in sent[1:-1]]
+
+        self.assertEqual(asyncio.run(listen()), [{'show': self.show.id, 'busy': 0, 'free': 10},
+                                                 {'show': self.show.id, 'busy': 3, 'free': 7}])
@@ -3,13 +3,17 @@ from django.urls import path, include
 from rest_framework import routers
 from rest_framework.authtoken import views
 from some.api.resources import ShowViewSet, PlaceViewSet, OrderListAPIView, CustomAuthToken, create_auth, \
-    FilmCreateAPIView
+    FilmCreateAPIView, SalesExportAPIView, AnalyticsViewSet, SeatHoldViewSet, \
+    InstrumentationViewSet, SearchAPIView, CalendarAPIView
 from some.views import LogView, OutView, RegView, ShowList, FilmCreateView, PlaceCreateView, ShowCreateView, \
-    OrderCreateView, ShowUpdateView, OrderListView, PlaceListView, PlaceUpdateView
+    OrderCreateView, ShowUpdateView, OrderListView, PlaceListView, PlaceUpdateView, CalendarView
 
 router = routers.SimpleRouter()
 router.register(r'shows', ShowViewSet)
 router.register(r'places', PlaceViewSet)
+router.register(r'analytics', AnalyticsViewSet, basename='analytics')
+router.register(r'holds', SeatHoldViewSet, basename='holds')
+router.register(r'instrumentation', InstrumentationViewSet, basename='instrumentation')
 #router.register(r'auth', CustomAuthToken)
 #router.register(r'orders', OrderListAPIView.as_view())
 
@@ -27,9 +31,13 @@ urlpatterns = [
     path('order/', OrderCreateView.as_view(), name='order'),
     path('show/<int:pk>/', ShowUpdateView.as_view(), name='update show'),
     path('orders/', OrderListView.as_view(), name='orders'),
+    path('calendar/', CalendarView.as_view(), name='calendar'),
     path('api/auth/', CustomAuthToken.as_view()),
     path('api/reg/', create_auth),
     path('api/', include(router.urls)),
     path('api/orders/', OrderListAPIView.as_view()),
     path('api/film/', FilmCreateAPIView.as_view()),
+    path('api/sales/export/', SalesExportAPIView.as_view()),
+    path('api/search/', SearchAPIView.as_view()),
+    path('api/calendar/', CalendarAPIView.as_view()),
 ]
\ No newline at end of file
@@ -1,16 +1,29 @@
 import datetime
+import hashlib
+from django.conf import settings
 from django.contrib import messages
+from django.contrib.messages import get_messages
 from django.contrib.auth import authenticate, login
 from django.contrib.auth.mixins import PermissionRequiredMixin, LoginRequiredMixin
 from django.contrib.auth.views import LoginView, LogoutView
-from django.db import IntegrityError
+from django.core.paginator import Page
+from django.db import IntegrityError, transaction
 from django.http import HttpResponseRedirect
+from django.middleware.csrf import get_token
 from django.utils import timezone
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 from some.models import MyUser, Show, Film, Place, Order
-from django.db.models import Q, F, Sum, Max
+from django.db.models import Q, Max
 from django.urls import reverse_lazy, reverse
-from django.views.generic import FormView, ListView, CreateView, UpdateView
+from django.views.generic import FormView, ListView, CreateView, UpdateView, TemplateView
 from some.forms import RegForm, FilmForm, PlaceForm, ShowForm, OrderForm
+from some import schedule_cache
+from some.overlap import overlapping
+from some.now_showing import calendar, upcoming
+from some.reservations import reserve_seats
+from some.routers import ReplicaReadMixin, pin_to_primary
+from some.spending import get_total
 
 
 class LogView(LoginView):
@@ -54,7 +67,24 @@ class OutView(LogoutView):
     next_page = 'main'
 
 
-class ShowList(ListView):
+CSRF_MIDDLEWARE = 'django.middleware.csrf.CsrfViewMiddleware'
+
+
+def show_list_etag(request, *args, **kwargs):
+    # the page also depends on the user and the csrf token, messages are shown only once
+    version = schedule_cache.version()
+    if version is None or len(get_messages(request)):
+        return None
+    csrf = ''
+    if CSRF_MIDDLEWARE in settings.MIDDLEWARE:
+        # a first visit gets its token here, so the tag already matches the cookie set with the response
+        get_token(request)
+        csrf = request.META['CSRF_COOKIE']
+    return f'{version}-{request.user.id}-{hashlib.md5(csrf.encode()).hexdigest()[:8]}'
+
+
+@method_decorator(condition(etag_func=show_list_etag), name='dispatch')
+class ShowList(ReplicaReadMixin, ListView):
     http_method_names = ['get']
     model = Show
     template_name = 'shows.html'
@@ -63,6 +93,21 @@ class ShowList(ListView):
     def get_context_data(self, *, object_list=None, **kwargs):
         return super().get_context_data(page_name='shows')
 
+    def paginate_queryset(self, queryset, page_size):
+        # keep the page of shows in the schedule cache, the paginator is rebuilt around it
+        params = self.request.GET
+        key = schedule_cache.make_key('html', *(params.get(name) for name in ('date', 'sort', 'page')))
+        cached = schedule_cache.get(key)
+        if cached is None:
+            paginator, page, object_list, is_paginated = super().paginate_queryset(queryset, page_size)
+            cached = (paginator.count, page.number, list(object_list))
+            schedule_cache.set(key, cached)
+        count, number, object_list = cached
+        paginator = self.get_paginator(object_list, page_size, allow_empty_first_page=self.get_allow_empty())
+        paginator.count = count
+        page = Page(object_list, number, paginator)
+        return paginator, page, object_list, paginator.num_pages > 1
+
     def get_ordering(self):
         param_order = self.request.GET.get('sort')
         if param_order == 'price':
@@ -72,7 +117,7 @@ class ShowList(ListView):
         return self.ordering
 
     def get_queryset(self):
-        queryset = super().get_queryset()
+        queryset = super().get_queryset().select_related('film')
         param_date = self.request.GET.get('date')
         now = timezone.now()
         if param_date:
@@ -99,16 +144,14 @@ class OrderCreateView(PermissionRequiredMixin, CreateView):
     success_url = reverse_lazy('main')
 
     def form_valid(self, form):
-        show_busy = form.cleaned_data['show'].busy
-        user_amount = form.cleaned_data['amount']
-        show = Show.objects.get(id=form.cleaned_data['show'].id)
-        if show_busy + user_amount > show.place.size:
+        self.object = reserve_seats(form.cleaned_data['show'].id, form.cleaned_data['user'].id,
+                                    form.cleaned_data['amount'])
+        if self.object is None:
             messages.error(self.request, f'Not enough free places')
             return HttpResponseRedirect(reverse('main'))
         messages.info(self.request, 'Thnx 4 order')
-        show.busy += user_amount
-        show.save()
-        return super().form_valid(form)
+        pin_to_primary(self.object.user_id)
+        return HttpResponseRedirect(self.get_success_url())
 
 
 class OrderListView(LoginRequiredMixin, ListView):
@@ -117,20 +160,49 @@ class OrderListView(LoginRequiredMixin, ListView):
     template_name = 'orders.html'
 
     def get_queryset(self):
-        self.queryset = super().get_queryset()
+        self.queryset = super().get_queryset().select_related('show__film')
         self.queryset = self.queryset.filter(user__id=self.request.user.id)
         return self.queryset
 
     def get_context_data(self, *, object_list=None, **kwargs):
         prev = super().get_context_data()
-        total = \
-            self.queryset.annotate(total=F('amount') * F('show__price')) \
-                .aggregate(Sum('total')).get('total__sum')
-        prev['total'] = total
+        prev['total'] = get_total(self.request.user.id)
         return prev
 
 
-class ShowUpdateView(PermissionRequiredMixin, UpdateView):
+class CalendarView(TemplateView):
+    # what is on in the next days, read from the materialized calendar
+    template_name = 'calendar.html'
+
+    def get_context_data(self, **kwargs):
+        now = timezone.now()
+        days = []
+        for date, films in calendar():
+            films = upcoming(films, now)
+            if not films:
+                continue
+            for film in films:
+                for show in film['shows']:
+                    show['start'] = datetime.datetime.fromisoformat(show['start'])
+            days.append((date, films))
+        return super().get_context_data(page_name='calendar', days=days, **kwargs)
+
+
+class ShowSaveMixin:
+    # the form asked the overlap index, which may miss shows written by other processes,
+    # so the schedule of the place is checked again in the transaction saving the show
+
+    def form_valid(self, form):
+        data = form.cleaned_data
+        with transaction.atomic():
+            if overlapping(data['place'].id, data['show_time_start'], data['show_time_end'],
+                           exclude=form.instance.pk) is not None:
+                form.add_error(None, 'Some show is already set in the same place simultaneously')
+                return self.form_invalid(form)
+            return super().form_valid(form)
+
+
+class ShowUpdateView(PermissionRequiredMixin, ShowSaveMixin, UpdateView):
     permission_required = 'request.user.is_superuser'
     model = Show
     form_class = ShowForm
@@ -190,7 +262,7 @@ class PlaceListView(PermissionRequiredMixin, ListView):
         return queryset
 
 
-class ShowCreateView(PermissionRequiredMixin, CreateView):
+class ShowCreateView(PermissionRequiredMixin, ShowSaveMixin, CreateView):
     permission_required = 'request.user.is_superuser'
     model = Show
     success_url = reverse_lazy('main')